@@ -3,48 +3,82 @@ import asyncio
 import aioredis
 
 import settings
-from app.boat_io import BoatModel
-
-
-async def auto_helm(boat_data: dict):
-    b = BoatModel()
+from app.boat_io import AsyncBoatModel
+from app.estimator import HeadingEstimator
+from app.scheduler import DeadlineClock
+
+
+# turn rate is scaled to deci-degrees per this period so that tsf values tuned on the original
+# 2Hz loop keep their meaning whatever the sample rate
+TURN_RATE_PERIOD = 0.5
+
+
+async def auto_helm(boat_data: dict, hw: AsyncBoatModel, sample_hz: float = 10, motor_hz: float = 5,
+                    helm_hz: float = 2, estimator: dict = None):
+    """
+    Autohelm control loop run on absolute deadlines at sample_hz. The compass is sampled every tick,
+    the motor drive is updated at motor_hz and the helm commands are read from Redis at helm_hz.
+    Heading and turn rate come from a HeadingEstimator fusing the gyro with the compass, or with HDM
+    when the external compass is selected, updated with the measured time between samples.
+    Loop jitter and overruns are reported in boat_data.
+    :param boat_data: Dict of current values
+    :param hw: opened hardware, shared with other tasks using the CMPS12
+    :param sample_hz: sensor sample rate
+    :param motor_hz: motor drive update rate, a divided rate of sample_hz
+    :param helm_hz: rate Redis helm commands are read, a divided rate of sample_hz
+    :param estimator: HeadingEstimator kwargs
+    """
+    b = hw.model
     b.power_on = 0
-    last_heading = None
+    heading_estimator = HeadingEstimator(**(estimator or {}))
     mode = 0
     old_compass_mode = 0
+    compass_mode = 1
     old_mode = -1
+    helm = {}
+    hts = 0
+    gain = 325
+    turn_speed_factor = 1454
     if settings.redis_host:
         redis = await aioredis.create_redis_pool(settings.redis_host)
     else:
         redis = None
 
+    clock = DeadlineClock(sample_hz)
+    motor_every = max(1, round(sample_hz / motor_hz))
+    helm_every = max(1, round(sample_hz / helm_hz))
+
     await asyncio.sleep(15)
     while redis:
-        await asyncio.sleep(.5)
-        b.alarm_off()
-        helm = await redis.hgetall("helm")
-        auto_mode = int(helm.get(b'auto_mode', "0"))
-        compass_mode = int(helm.get(b'compass_mode', "1"))
-
-        if auto_mode:
-            if auto_mode == 1:
-                b.power_on = 0
-            else:
-                b.power_on = 1
-            mode = auto_mode      # set when auto_mode is >0
-            b.rudder = 0
-            await redis.hset("helm", "auto_mode", 0)
-
-        heading = b.read_compass()  # heading is *10 deci-degrees
+        dt = await clock.tick()
+        read_helm = clock.every(helm_every)
+        if read_helm:
+            await hw.alarm_off()
+            helm = await redis.hgetall("helm")
+            auto_mode = int(helm.get(b'auto_mode', "0"))
+            compass_mode = int(helm.get(b'compass_mode', "1"))
+
+            if auto_mode:
+                if auto_mode == 1:
+                    b.power_on = 0
+                else:
+                    b.power_on = 1
+                mode = auto_mode      # set when auto_mode is >0
+                b.rudder = 0
+                await redis.hset("helm", "auto_mode", 0)
+
+        sample = await hw.read_cmps_block()  # one i2c transaction for heading, gyro, roll, pitch and calibration
+        compass = b.compass  # compass is *10 deci-degrees
         boat_data["compass_cal"] = b.calibration
         # use HDM if available
         hdm = boat_data.get('HDM', None)
+        external = None
 
         if hdm is not None:
             hdm10 = int(hdm * 10)
-            boat_data["head_diff"] = relative_direction(heading - hdm10)
+            boat_data["head_diff"] = relative_direction(compass - hdm10)
             if compass_mode == 2:
-                heading = hdm10
+                external = hdm10
         else:
             compass_mode = 1
 
@@ -53,14 +87,17 @@ async def auto_helm(boat_data: dict):
                 boat_data["compass_mode"] = "ext"
             else:
                 boat_data["compass_mode"] = "int"
-            b.alarm_on()
+            await hw.alarm_on()
             old_compass_mode = compass_mode
 
+        heading, turn_rate = heading_estimator.update(compass, sample.gyo_z if sample else None, dt, external)
+        heading = int(round(heading)) % 3600
+        turn_rate *= TURN_RATE_PERIOD
         boat_data["compass"] = heading/10
-        await redis.hset("current_data", "compass", boat_data["compass"])
+        boat_data["turn_rate"] = round(heading_estimator.turn_rate / 10, 1)  # degrees per second
 
-        heal = b.read_roll()
-        pitch = b.read_pitch()
+        heal = b.roll
+        pitch = b.pitch
         try:
             boat_data["max_heal"] = max(boat_data["max_heal"], heal)
             boat_data["min_heal"] = min(boat_data["min_heal"], heal)
@@ -69,31 +106,29 @@ async def auto_helm(boat_data: dict):
         except Exception:
            pass
 
-        if last_heading is None:
-            last_heading = heading
-
-        hts_str = helm.get(b'hts')
+        if read_helm:
+            await redis.hset("current_data", "compass", boat_data["compass"])
+            hts_str = helm.get(b'hts')
 
-        if hts_str:
-            try:
-                hts = int(hts_str)
-            except ValueError:
-                hts = 0
-        else:
-            hts = int((boat_data.get('hts', 0) + boat_data.get('mag_var', 0))*10)
+            if hts_str:
+                try:
+                    hts = int(hts_str)
+                except ValueError:
+                    hts = 0
+            else:
+                hts = int((boat_data.get('hts', 0) + boat_data.get('mag_var', 0))*10)
 
-        gain = 325
-        gain_str = helm.get(b'gain')
-        if gain_str:
-            gain = 1 + int(gain_str)
+            gain = 325
+            gain_str = helm.get(b'gain')
+            if gain_str:
+                gain = 1 + int(gain_str)
 
-        turn_speed_factor = 1454
-        turn_speed_factor_str = helm.get(b'tsf')
-        if turn_speed_factor_str:
-            turn_speed_factor = 1 + int(turn_speed_factor_str)
+            turn_speed_factor = 1454
+            turn_speed_factor_str = helm.get(b'tsf')
+            if turn_speed_factor_str:
+                turn_speed_factor = 1 + int(turn_speed_factor_str)
 
         error_correct = relative_direction(hts - heading)
-        turn_rate = relative_direction(heading - last_heading)
 
         # drive is base on PID principles applied to motor drive which inherently
         # integrates so the base_line duty is in effect an integrator, and the turn_rate
@@ -104,15 +139,16 @@ async def auto_helm(boat_data: dict):
         # so drive would be reduced if say turning at
         # 1 degree per sec = 5 deci-degrees per sample * 5 = 25 * gain (4000) +base = 20%-30% = 10%
 
-        correction = int((error_correct - turn_rate * turn_speed_factor/100) * gain)
+        correction = int(helm_correction(error_correct, turn_rate, gain, turn_speed_factor))
 
-        if mode == 2:
-            b.base_line_duty = int(helm.get(b'base_duty', "100000"))
-            b.helm(correction)
-        elif mode == 3:
-            b.base_line_duty = 0
-            drive = int(helm.get(b'drive', 0)) * 10000
-            b.helm(drive)
+        if clock.every(motor_every):
+            if mode == 2:
+                b.base_line_duty = int(helm.get(b'base_duty', "100000"))
+                await hw.helm(correction)
+            elif mode == 3:
+                b.base_line_duty = 0
+                drive = int(helm.get(b'drive', 0)) * 10000
+                await hw.helm(drive)
 
         if mode != old_mode:
             if mode == 2:
@@ -121,7 +157,7 @@ async def auto_helm(boat_data: dict):
                 boat_data["auto_helm"] = "manual"
             else:
                 boat_data["auto_helm"] = "stand-by"
-            b.alarm_on()
+            await hw.alarm_on()
             old_mode = mode
 
         boat_data['hts'] = round(hts/10,1)
@@ -130,10 +166,23 @@ async def auto_helm(boat_data: dict):
         boat_data["base_duty"] = b.base_line_duty
         boat_data["power"] = b.applied_helm_power
         boat_data["rudder"] = int(b.rudder)
-        last_heading = heading
+        if read_helm:
+            boat_data.update(clock.stats())
     print("No redis connection")
 
 
+def helm_correction(error_correct, turn_rate, gain, turn_speed_factor):
+    """
+    Helm motor drive before the base line duty is added, positive to starboard.
+    Written with arithmetic only so the simulator can evaluate arrays of gains at once
+    :param error_correct: heading error in deci-degrees
+    :param turn_rate: deci-degrees per TURN_RATE_PERIOD
+    :param gain: overall gain
+    :param turn_speed_factor: turn rate damping in 1/100 units
+    """
+    return (error_correct - turn_rate * turn_speed_factor/100) * gain
+
+
 def relative_direction(diff):
     if diff < -1800:
         diff += 3600
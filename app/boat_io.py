@@ -1,14 +1,51 @@
+import asyncio
+import struct
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep, monotonic
+
 import pigpio
 
+# CMPS12 registers 0x02 to 0x1E read as one block - big endian as the hi byte is at the lower register
+CMPS12_BLOCK_START = 0x02
+CMPS12_BLOCK = struct.Struct('>Hbb3h3h3hhHhB')
+
+CmpsSample = namedtuple('CmpsSample', [
+    'compass',  # deci-degrees 0-3599
+    'pitch', 'roll',  # degrees +/- 90
+    'mag_x', 'mag_y', 'mag_z',
+    'acc_x', 'acc_y', 'acc_z',
+    'gyo_x', 'gyo_y', 'gyo_z',
+    'temp',
+    'bosch_heading',  # 1/16 degree
+    'pitch_16',
+    'calibration'
+])
+
+
+def decode_cmps_block(block: bytes) -> CmpsSample:
+    """
+    Decodes the CMPS12 register block starting at 0x02 in a single unpack
+    :param block: bytes read from register 0x02 onwards of length CMPS12_BLOCK.size
+    :return: CmpsSample of all values read in the same transaction
+    """
+    return CmpsSample(*CMPS12_BLOCK.unpack(block))
+
 
 class BoatModel:
 
-    def __init__(self):
+    def __init__(self, pi=None, clock=monotonic):
+        """
+        :param pi: pigpio connection, defaults to the local pigpio daemon. The simulator passes a
+                   simulated pi here so the same model can be run off the boat
+        :param clock: monotonic time source in seconds
+        """
         self._alarm_pin = 25
         self._port_pin = 24
         self._starboard_pin = 23
-        self._pi = pigpio.pi('localhost', 8888)
+        self._pwm_pin = 18
+        self._clock = clock
+        self._pi = pi if pi is not None else pigpio.pi('localhost', 8888)
         self._pi.set_mode(self._starboard_pin, pigpio.OUTPUT)
         self._pi.set_mode(self._port_pin, pigpio.OUTPUT)
         self._pi.set_mode(self._alarm_pin, pigpio.OUTPUT)   # Alarm pin 1 pull down darlington
@@ -30,7 +67,8 @@ class BoatModel:
         self.run = 1
         self.alarm_state = 0
         self.base_line_duty = 0
-        self.last_power_at = monotonic()
+        self.last_power_at = clock()
+        self.sample = None
 
     def _port(self):
         self._pi.write(self._starboard_pin, 0)
@@ -52,6 +90,38 @@ class BoatModel:
             self._pi.i2c_read_byte_data(self._cm, lo_reg)
         ], byteorder='big', signed=True)
 
+    def read_cmps_block(self):
+        """
+        Reads all CMPS12 registers in one i2c transaction so heading, pitch, roll and calibration
+        are a consistent snapshot. Updates compass, pitch, roll and calibration as the single register
+        reads do.
+        :return: CmpsSample or None if the block read was short
+        """
+        count, block = self._pi.i2c_read_i2c_block_data(self._cm, CMPS12_BLOCK_START, CMPS12_BLOCK.size)
+        if count != CMPS12_BLOCK.size:
+            return None
+        self.sample = decode_cmps_block(bytes(block))
+        self.compass = self.sample.compass + self.compass_correction
+        if self.compass > 3600:
+            self.compass -= 3600
+        if self.compass < 0:
+            self.compass += 3600
+        self.pitch = self.sample.pitch
+        self.roll = self.sample.roll
+        self.calibration = self.sample.calibration
+        return self.sample
+
+    def read_attitude(self):
+        """
+        Reads pitch and roll in one 2 byte i2c transaction for high rate motion sampling
+        :return: pitch, roll in degrees or None if the read was short
+        """
+        count, block = self._pi.i2c_read_i2c_block_data(self._cm, 0x04, 2)
+        if count != 2:
+            return None
+        self.pitch, self.roll = struct.unpack('bb', bytes(block))
+        return self.pitch, self.roll
+
     def read_compass(self):
         # Read Compass in  deci-degrees
         self.compass = self._read_signed_word(2, 3) + self.compass_correction
@@ -75,33 +145,16 @@ class BoatModel:
         return self.roll
 
     def _read_cmps_data(self):
-        # Read Compass in  deci-degrees
-        self.read_compass()
-        self.read_pitch()
-        self.read_roll()
-
-        acc_x = self._read_signed_word(0x0C, 0x0D)
-        acc_y = self._read_signed_word(0x0E, 0x0F)
-        acc_z = self._read_signed_word(0x10, 0x11)
-
-        gyo_x = self._read_signed_word(0x12, 0x13)
-        gyo_y = self._read_signed_word(0x14, 0x15)
-        gyo_z = self._read_signed_word(0x16, 0x17)
-
-        mag_x = self._read_signed_word(0x06, 0x07)
-        mag_y = self._read_signed_word(0x08, 0x09)
-        mag_z = self._read_signed_word(0x0A, 0x0B)
-
-        bosch_heading = self.read_bosch_heading()
-        pitch_16 = self._read_signed_word(0x1C, 0x1D)
-
-        temp = self._read_signed_word(0x18, 0x19)
+        sample = self.read_cmps_block()
+        if sample is None:
+            return
 
         print("{} temp {} head {} {} roll {} pitch {} {}"
               "  acc {} {} {}  gyo {} {} {} mag {} {} {}".
-              format(self.calibration, temp, self.compass, bosch_heading, self.roll, self.pitch, pitch_16,
-                     acc_x, acc_y, acc_z,
-                     gyo_x, gyo_y, gyo_z, mag_x, mag_y, mag_z
+              format(sample.calibration, sample.temp, self.compass, sample.bosch_heading / 16,
+                     self.roll, self.pitch, sample.pitch_16,
+                     sample.acc_x, sample.acc_y, sample.acc_z,
+                     sample.gyo_x, sample.gyo_y, sample.gyo_z, sample.mag_x, sample.mag_y, sample.mag_z
                      ))
 
     def update(self):
@@ -147,12 +200,12 @@ class BoatModel:
             self.applied_helm_power = 0
             duty = 0
 
-        time_now = monotonic()
+        time_now = self._clock()
         self.rudder += self.applied_helm_power * (time_now - self.last_power_at)/1000000
         self.last_power_at = time_now
         # 5khz rate - pulse width is fraction of 1M
         # print(duty)
-        self._pi.hardware_PWM(18, 5000, duty)
+        self._pi.hardware_PWM(self._pwm_pin, 5000, duty)
 
     def config_save(self):
         self._pi.i2c_write_byte_data(self._cm, 0, 0xF0)
@@ -172,4 +225,54 @@ class BoatModel:
         self._pi.i2c_write_byte_data(self._cm, 0, 0xE2)
         sleep(.025)
         print("deleted config")
-        sleep(2.0)
\ No newline at end of file
+        sleep(2.0)
+
+
+class AsyncBoatModel:
+
+    def __init__(self, model_factory=BoatModel):
+        """
+        Runs a BoatModel on a dedicated I/O thread so that pigpio socket calls and the sleeps
+        used when saving or deleting calibration never block the event loop. The single worker
+        thread executes calls in the order they are queued and each call is awaited for its result.
+        The model attributes (power_on, base_line_duty, rudder etc) can be read and set directly
+        between calls.
+        :param model_factory: callable returning the model to run, called on the I/O thread
+        """
+        self._factory = model_factory
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='boat_io')
+        self.model = None
+
+    async def run(self, func, *args):
+        """
+        Queues func(*args) to the I/O thread and waits for the result
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def open(self):
+        self.model = await self.run(self._factory)
+        return self.model
+
+    async def read_cmps_block(self):
+        return await self.run(self.model.read_cmps_block)
+
+    async def read_attitude(self):
+        return await self.run(self.model.read_attitude)
+
+    async def helm(self, correction):
+        await self.run(self.model.helm, correction)
+
+    async def alarm_on(self):
+        await self.run(self.model.alarm_on)
+
+    async def alarm_off(self):
+        await self.run(self.model.alarm_off)
+
+    async def config_save(self):
+        await self.run(self.model.config_save)
+
+    async def config_delete(self):
+        await self.run(self.model.config_delete)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
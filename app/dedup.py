@@ -0,0 +1,90 @@
+from collections import Counter, deque
+from time import monotonic
+
+
+class LineDedup:
+
+    def __init__(self, windows: dict, clock=monotonic, stats: dict = None, echo_window: float = 1.0) -> None:
+        """
+        Drops a sentence already sent to the same destination within a short time window, eg one sent to the
+        NMEA 2000 gateway which the gateway echoes back. A time limited set of line hashes is kept for each
+        channel (queue name or the decoder) so a line reaching a queue by two routes is only queued once while
+        other queues still receive it.
+        A window should be shorter than the interval at which a sentence may legitimately repeat unchanged.
+        :param windows: seconds by sentence id eg {"default": 1.0, "VDM": 2.0, "HDM": 0}, 0 to not check
+        :param clock: monotonic time source
+        :param stats: optional dict eg boat_data in which the total suppressed is kept as dup_suppressed
+        :param echo_window: seconds a line sent to a watched channel is remembered for is_echo, long enough for
+                            the round trip through the gateway
+        """
+        self.default_window = windows.get("default", 0)
+        self.windows = {sentence_id.encode(): secs for sentence_id, secs in windows.items() if sentence_id != "default"}
+        self.suppressed = Counter()  # by channel
+        self._clock = clock
+        self._stats = stats
+        self._seen = {}  # (channel, line hash): expiry
+        self._expiries = deque()  # (expiry, key) in the order added
+        self.echo_window = echo_window
+        self._watched = set()  # channels recorded for is_echo
+
+    def _prune(self, now: float) -> None:
+        expiries = self._expiries
+        while expiries and expiries[0][0] <= now:
+            expiry, key = expiries.popleft()
+            if self._seen.get(key) == expiry:
+                del self._seen[key]
+
+    def watch(self, channel) -> None:
+        """
+        Records lines sent to the channel for is_echo
+        """
+        self._watched.add(channel)
+
+    def _remember(self, key, expiry: float) -> None:
+        if self._seen.get(key, 0) < expiry:
+            self._seen[key] = expiry
+            self._expiries.append((expiry, key))
+
+    def is_echo(self, line: bytes, channel) -> bool:
+        """
+        True if the line was sent to the watched channel within the echo window, eg a sentence read back from
+        the gateway which was sent to it; counted as suppressed on the echo channel
+        """
+        now = self._clock()
+        self._prune(now)
+        if self._seen.get(("echo", channel, hash(line.rstrip())), 0) > now:
+            self.suppressed["echo"] += 1
+            if self._stats is not None:
+                self._stats["dup_suppressed"] = sum(self.suppressed.values())
+            return True
+        return False
+
+    def filter(self, line: bytes, channels) -> list:
+        """
+        Records the line as sent to each channel where it is not a duplicate
+        :param line: sentence read
+        :param channels: names of the destinations
+        :return: channels the line should be sent to
+        """
+        window = self.windows.get(line[3:6], self.default_window)
+        watched = self._watched.intersection(channels)
+        if not window and not watched:
+            return list(channels)
+        now = self._clock()
+        self._prune(now)
+        line_hash = hash(line.rstrip())
+        for channel in watched:
+            self._remember(("echo", channel, line_hash), now + self.echo_window)
+        if not window:
+            return list(channels)
+        send = []
+        for channel in channels:
+            key = (channel, line_hash)
+            if self._seen.get(key, 0) > now:
+                self.suppressed[channel] += 1
+                continue
+            self._remember(key, now + window)
+            send.append(channel)
+        if self._stats is not None and len(send) < len(channels):
+            self._stats["dup_suppressed"] = sum(self.suppressed.values())
+        return send
@@ -0,0 +1,178 @@
+"""
+Derived quantities calculated from the decoded NMEA data.
+
+Each output is declared with the data names it depends on. DerivedData.update is given the names changed
+by a decoded sentence and recalculates only the outputs depending on them, in dependency order, so an output
+changed by an update immediately updates those depending on it. An output is removed when an input is missing
+or it cannot be calculated.
+
+    DBK  depth below keel metres when TOFF is negative (DPT offset to keel)
+    DBS  depth below surface metres when TOFF is positive (DPT offset to waterline)
+    HDT  true heading from HDM and mag_var, not given without mag_var
+    VMG  velocity made good towards the destination knots, from SOG, TMG and BPD
+    trip distance nm from successive valid position fixes
+    AWS  apparent wind speed knots, AWA apparent wind angle, from MWV relative to the bow
+    TWS  true wind speed knots, TWA true wind angle, using STW
+    TWD  true wind direction
+"""
+from math import atan2, cos, degrees, hypot, radians, sin
+from typing import Callable
+
+TO_KNOTS = {"N": 1.0, "K": 1 / 1.852, "M": 3600 / 1852}
+EARTH_RADIUS_NM = 3440.065
+
+
+class Derived:
+
+    def __init__(self, name: str, inputs: tuple, func: Callable, defaults: dict = None) -> None:
+        """
+        :param name: output name in boat data
+        :param inputs: names of the values passed to func in order
+        :param func: returns the output value or None if it cannot be calculated
+        :param defaults: values used for inputs which are missing, other missing inputs remove the output
+        """
+        self.name = name
+        self.inputs = inputs
+        self.func = func
+        self.defaults = defaults or {}
+
+
+def depth_below_keel(dbt, toff):
+    return round(dbt + toff, 2) if toff <= 0 else None
+
+
+def depth_below_surface(dbt, toff):
+    return round(dbt + toff, 2) if toff > 0 else None
+
+
+def true_heading(hdm, mag_var):
+    # mag_var is E positive
+    return round((hdm + mag_var) % 360, 1)
+
+
+def vmg(sog, tmg, bpd):
+    return round(sog * cos(radians(tmg - bpd)), 2)
+
+
+def apparent_wind_speed(wind_ref, wind_speed, wind_units):
+    if wind_ref != 'R' or wind_units not in TO_KNOTS:
+        return None
+    return round(wind_speed * TO_KNOTS[wind_units], 1)
+
+
+def apparent_wind_angle(wind_ref, wind_angle):
+    return wind_angle if wind_ref == 'R' else None
+
+
+def _true_wind(awa, aws, stw):
+    # wind over the boat less the boat speed gives the wind over the water; x forward y to starboard
+    x = aws * cos(radians(awa)) - stw
+    y = aws * sin(radians(awa))
+    return hypot(x, y), degrees(atan2(y, x)) % 360
+
+
+def true_wind_speed(awa, aws, stw):
+    return round(_true_wind(awa, aws, stw)[0], 1)
+
+
+def true_wind_angle(awa, aws, stw):
+    return round(_true_wind(awa, aws, stw)[1], 1)
+
+
+def true_wind_direction(twa, hdt):
+    return round((twa + hdt) % 360, 1)
+
+
+class TripDistance:
+
+    def __init__(self, min_step: float = 0.01) -> None:
+        """
+        Accumulates the great circle distance between position fixes, ignoring moves less than
+        min_step nm from the last point counted so GPS wander at anchor does not add up
+        """
+        self.min_step = min_step
+        self.distance = 0.0
+        self._last = None
+
+    def reset(self) -> None:
+        self.distance = 0.0
+        self._last = None
+
+    def __call__(self, lat, long):
+        if self._last is not None:
+            lat1, long1 = map(radians, self._last)
+            lat2, long2 = radians(lat), radians(long)
+            a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((long2 - long1) / 2) ** 2
+            step = 2 * EARTH_RADIUS_NM * atan2(a ** 0.5, (1 - a) ** 0.5)
+            if step < self.min_step:
+                return round(self.distance, 2)
+            self.distance += step
+        self._last = (lat, long)
+        return round(self.distance, 2)
+
+
+def default_nodes() -> list:
+    return [
+        Derived("DBK", ("DBT", "TOFF"), depth_below_keel),
+        Derived("DBS", ("DBT", "TOFF"), depth_below_surface),
+        Derived("HDT", ("HDM", "mag_var"), true_heading),
+        Derived("VMG", ("SOG", "TMG", "BPD"), vmg),
+        Derived("trip", ("lat", "long"), TripDistance()),
+        Derived("AWS", ("wind_ref", "wind_speed", "wind_units"), apparent_wind_speed),
+        Derived("AWA", ("wind_ref", "wind_angle"), apparent_wind_angle),
+        Derived("TWS", ("AWA", "AWS", "STW"), true_wind_speed),
+        Derived("TWA", ("AWA", "AWS", "STW"), true_wind_angle),
+        Derived("TWD", ("TWA", "HDT"), true_wind_direction),
+    ]
+
+
+class DerivedData:
+
+    def __init__(self, nodes: list = None) -> None:
+        """
+        :param nodes: Derived outputs, default_nodes() if not given. Sorted so each output is calculated
+                      after any outputs it depends on
+        """
+        remaining = list(default_nodes() if nodes is None else nodes)
+        outputs = {node.name for node in remaining}
+        self.nodes = []
+        done = set()
+        while remaining:
+            ready = [node for node in remaining if all(i in done or i not in outputs for i in node.inputs)]
+            if not ready:
+                raise ValueError(f"Derived outputs depend on each other: {[node.name for node in remaining]}")
+            for node in ready:
+                self.nodes.append(node)
+                done.add(node.name)
+                remaining.remove(node)
+
+    def update(self, data: dict, changed) -> list:
+        """
+        Recalculates the outputs depending on the changed names
+        :param data: boat data containing the inputs, outputs are set or removed here
+        :param changed: names of the values set or deleted in data since the last update
+        :return: names of the outputs set or deleted
+        """
+        dirty = set(changed)
+        updated = []
+        for node in self.nodes:
+            if dirty.isdisjoint(node.inputs):
+                continue
+            value = None
+            try:
+                args = [data[name] if name in data else node.defaults[name] for name in node.inputs]
+                value = node.func(*args)
+            except KeyError:
+                pass
+            except (TypeError, ValueError) as err:
+                print(f"Derived {node.name} error: {err}")
+            if value is None:
+                if node.name in data:
+                    del data[node.name]
+                    dirty.add(node.name)
+                    updated.append(node.name)
+            elif data.get(node.name) != value:
+                data[node.name] = value
+                dirty.add(node.name)
+                updated.append(node.name)
+        return updated
@@ -0,0 +1,67 @@
+def wrap_direction(diff):
+    """
+    Wraps a difference in deci-degrees to -1800 to 1800. Arithmetic only so it works on numpy arrays
+    """
+    return (diff + 1800) % 3600 - 1800
+
+
+class HeadingEstimator:
+
+    def __init__(self, time_constant: float = 2.0, bias_time_constant: float = 60.0,
+                 rate_time_constant: float = 0.3, gyro_scale: float = -1/16, external_weight: float = 1.0) -> None:
+        """
+        Complementary filter fusing the CMPS12 gyro z rate with a reference heading.
+        The gyro is integrated for the short term heading and turn rate and the heading is pulled towards
+        the reference with time_constant, so compass noise is smoothed without the lag of differencing
+        successive headings. A slow integrator removes the gyro bias.
+        The reference is the internal compass, or when an external heading such as HDM is given
+        the compass moved external_weight of the way towards it.
+        Works on scalars or on numpy arrays of boats as used by the simulator.
+        :param time_constant: seconds for the heading to follow the reference
+        :param bias_time_constant: seconds for the gyro bias estimate to settle
+        :param rate_time_constant: seconds smoothing of the turn rate
+        :param gyro_scale: degrees per second per gyro count, negative as the gyro z axis is anti clockwise
+        :param external_weight: 0 to 1 weight of an external heading against the internal compass
+        """
+        self.time_constant = time_constant
+        self.bias_time_constant = bias_time_constant
+        self.rate_time_constant = rate_time_constant
+        self.gyro_scale = gyro_scale * 10  # to deci-degrees
+        self.external_weight = external_weight
+        self.heading = None
+        self.turn_rate = 0.0
+        self.bias = 0.0
+        self._last_reference = None
+
+    def update(self, compass, gyro_z, dt: float, external=None):
+        """
+        Updates the estimate with a new sample
+        :param compass: internal compass heading deci-degrees
+        :param gyro_z: raw gyro z reading or None if not available, the turn rate then comes from
+                       the change in reference
+        :param dt: seconds since the last sample
+        :param external: optional external heading deci-degrees
+        :return: heading deci-degrees 0-3600 and turn rate deci-degrees per second
+        """
+        reference = compass
+        if external is not None:
+            reference = compass + self.external_weight * wrap_direction(external - compass)
+
+        if self.heading is None or dt <= 0:
+            self.heading = reference % 3600
+            self._last_reference = reference
+            return self.heading, self.turn_rate
+
+        if gyro_z is None:
+            rate = wrap_direction(reference - self._last_reference) / dt
+        else:
+            rate = gyro_z * self.gyro_scale - self.bias
+        self._last_reference = reference
+
+        predicted = self.heading + rate * dt
+        error = wrap_direction(reference - predicted)
+        self.heading = (predicted + error * dt / (self.time_constant + dt)) % 3600
+        if gyro_z is not None:
+            self.bias = self.bias - error * dt / (self.time_constant * self.bias_time_constant)
+        self.turn_rate = self.turn_rate + (rate - self.turn_rate) * dt / (self.rate_time_constant + dt)
+        return self.heading, self.turn_rate
@@ -0,0 +1,199 @@
+"""
+WebSocket live data feed for displays on board.
+
+Connect to ws://<pi>:8091/live optionally choosing variables and a maximum update rate in Hz
+eg ws://<pi>:8091/live?vars=compass,SOG,auto_helm&rate=2 or by sending {"vars": [...], "rate": 2} at any time.
+Empty vars means everything. The first message is a snapshot of the chosen variables, then each message is a
+JSON object of only the variables which changed, with null for one which has gone.
+"""
+import asyncio
+import json
+from math import ceil
+
+from aiohttp import WSMsgType, web
+
+from app.scheduler import DeadlineClock
+
+_MISSING = object()
+_BAD_REQUEST = json.dumps({"error": "expected {\"vars\": [...], \"rate\": Hz}"})
+
+
+class _Client:
+
+    __slots__ = ['ws', 'queue', 'group']
+
+    def __init__(self, ws: web.WebSocketResponse, queue_size: int) -> None:
+        self.ws = ws
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.group = None
+
+
+class _Group:
+
+    __slots__ = ['names', 'every', 'clients', 'pending']
+
+    def __init__(self, names: frozenset, every: int) -> None:
+        """
+        Clients with the same variables and rate share the changes and each payload is serialised once
+        """
+        self.names = names
+        self.every = every
+        self.clients = set()
+        self.pending = {}
+
+
+class LiveFeed:
+
+    def __init__(self, boat_data: dict, host: str = '0.0.0.0', port: int = 8091, tick_hz: float = 10,
+                 queue_size: int = 8) -> None:
+        """
+        :param boat_data: Dict of current values including the autohelm state
+        :param host: address to listen on
+        :param port: port to listen on
+        :param tick_hz: rate boat data is checked for changes, the fastest a client can be updated
+        :param queue_size: messages queued for a client before it is dropped as too slow
+        """
+        self.boat_data = boat_data
+        self.host = host
+        self.port = port
+        self.tick_hz = tick_hz
+        self.queue_size = queue_size
+        self.groups = {}  # (names, every): _Group
+        self.dropped = 0
+        self._last = {}
+
+    def _subscribe(self, client: _Client, names, rate) -> None:
+        """
+        :param names: list of variable names, empty or None for everything
+        :param rate: maximum Hz, None for every tick
+        :raises ValueError: names not a list of names or rate not a positive number, the subscription is unchanged
+        """
+        if names is None:
+            names = []
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            raise ValueError(f"vars {names!r} is not a list of names")
+        if rate is None:
+            every = 1
+        else:
+            if isinstance(rate, bool) or not isinstance(rate, (int, float, str)):
+                raise ValueError(f"rate {rate!r} is not a number")
+            rate = float(rate)
+            if not 0 < rate < float('inf'):
+                raise ValueError(f"rate {rate} is not a positive number")
+            every = max(1, ceil(self.tick_hz / rate))
+        names = frozenset(name for name in names if name)
+        self._unsubscribe(client)
+        if not self.groups:
+            # changes are not tracked without clients so start from the snapshot sent
+            self._last = dict(self.boat_data)
+        group = self.groups.get((names, every))
+        if group is None:
+            group = self.groups[(names, every)] = _Group(names, every)
+        group.clients.add(client)
+        client.group = group
+        snapshot = {n: v for n, v in self.boat_data.items() if not names or n in names}
+        self._send(client, json.dumps(snapshot, default=str))
+
+    def _unsubscribe(self, client: _Client) -> None:
+        group = client.group
+        if group is not None:
+            group.clients.discard(client)
+            if not group.clients:
+                del self.groups[(group.names, group.every)]
+            client.group = None
+
+    def _send(self, client: _Client, payload: str) -> None:
+        try:
+            client.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # too slow to keep up so drop it rather than queue without limit
+            self.dropped += 1
+            self._unsubscribe(client)
+            asyncio.ensure_future(client.ws.close(code=1008, message=b'too slow'))
+
+    async def _writer(self, client: _Client) -> None:
+        while True:
+            payload = await client.queue.get()
+            try:
+                await client.ws.send_str(payload)
+            except (ConnectionError, RuntimeError) as err:
+                # closed under us, the handler finishes when the socket's receive ends
+                print(f"Live feed client dropped: {err!r}")
+                self._unsubscribe(client)
+                return
+
+    async def _handle(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        client = _Client(ws, self.queue_size)
+        writer = asyncio.ensure_future(self._writer(client))
+        try:
+            try:
+                self._subscribe(client, request.query.get('vars', '').split(','), request.query.get('rate'))
+            except ValueError:
+                # nothing is sent until a valid subscription is sent
+                await ws.send_str(_BAD_REQUEST)
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT:
+                    try:
+                        request_data = json.loads(msg.data)
+                        self._subscribe(client, request_data.get('vars'), request_data.get('rate'))
+                    except (ValueError, TypeError, AttributeError):
+                        await ws.send_str(_BAD_REQUEST)
+        finally:
+            self._unsubscribe(client)
+            writer.cancel()
+        return ws
+
+    def _changes(self) -> dict:
+        """
+        Variables changed since the last tick, None for those removed
+        """
+        current = self.boat_data
+        last = self._last
+        changes = {n: v for n, v in current.items() if last.get(n, _MISSING) != v}
+        for name in last.keys() - current.keys():
+            changes[name] = None
+        self._last = dict(current)
+        return changes
+
+    def tick(self, count: int) -> None:
+        """
+        Works out the changes once then sends each group its pending changes when due
+        """
+        if not self.groups:
+            return
+        changes = self._changes()
+        for group in list(self.groups.values()):
+            if changes:
+                if group.names:
+                    group.pending.update((n, v) for n, v in changes.items() if n in group.names)
+                else:
+                    group.pending.update(changes)
+            if group.pending and count % group.every == 0:
+                payload = json.dumps(group.pending, default=str)
+                group.pending = {}
+                for client in list(group.clients):
+                    self._send(client, payload)
+
+    async def run(self) -> None:
+        """
+        Serves the feed and checks boat_data for changes tick_hz times a second
+        """
+        app = web.Application()
+        app.router.add_get('/live', self._handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        print(f"Live feed at ws://{self.host}:{self.port}/live")
+        clock = DeadlineClock(self.tick_hz)
+        while True:
+            await clock.tick()
+            self.tick(clock.ticks)
+
+
+async def live_feed(boat_data: dict, **kwargs) -> None:
+    """
+    Serves the live feed, kwargs as LiveFeed
+    """
+    await LiveFeed(boat_data, **kwargs).run()
@@ -0,0 +1,248 @@
+"""
+Event loop instrumentation.
+
+LoopMonitor measures event loop lag, times every step of each task created after it is installed and runs a
+watchdog thread which reports the task name and stack of anything holding the loop for longer than slow_secs.
+A sampling profiler of the loop thread can be run for a window without restarting. Results are printed to the
+log, lag is published in boat_data and everything is available as JSON from a local http endpoint:
+
+    GET /monitor               lag, per task counters and recent slow steps
+    GET /profile?seconds=10    samples the loop thread for the given seconds and returns the hottest lines
+"""
+import asyncio
+import collections.abc
+import sys
+import threading
+import traceback
+from collections import Counter, deque
+from time import monotonic, perf_counter, sleep
+
+from aiohttp import web
+
+
+class TaskStats:
+
+    __slots__ = ['steps', 'total', 'max', 'slow']
+
+    def __init__(self) -> None:
+        self.steps = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+
+    def as_dict(self) -> dict:
+        return {"steps": self.steps, "total_ms": round(self.total * 1000, 1), "max_ms": round(self.max * 1000, 2),
+                "slow": self.slow}
+
+
+class _TimedCoroutine(collections.abc.Coroutine):
+
+    def __init__(self, coro, name: str, monitor: 'LoopMonitor') -> None:
+        """
+        Wraps a task's coroutine timing each step, ie each time the task runs until its next await
+        """
+        self._coro = coro
+        self._name = name
+        self._monitor = monitor
+        self._stats = monitor.tasks.setdefault(name, TaskStats())
+
+    def _step(self, method, *args):
+        monitor = self._monitor
+        start = perf_counter()
+        monitor.running = (self._name, start)
+        try:
+            return method(*args)
+        finally:
+            elapsed = perf_counter() - start
+            monitor.running = None
+            stats = self._stats
+            stats.steps += 1
+            stats.total += elapsed
+            if elapsed > stats.max:
+                stats.max = elapsed
+            if elapsed > monitor.slow_secs:
+                stats.slow += 1
+
+    def send(self, value):
+        return self._step(self._coro.send, value)
+
+    def throw(self, *args):
+        return self._step(self._coro.throw, *args)
+
+    def close(self):
+        return self._coro.close()
+
+    def __await__(self):
+        return self._coro.__await__()
+
+
+class LoopMonitor:
+
+    def __init__(self, interval: float = 0.1, slow_secs: float = 0.1, report_secs: float = 60,
+                 host: str = '127.0.0.1', port: int = 8090, stack_depth: int = 8) -> None:
+        """
+        :param interval: seconds between lag measurements and watchdog checks
+        :param slow_secs: a task step or callback holding the loop longer than this is reported
+        :param report_secs: seconds between summaries printed to the log
+        :param host: address of the http endpoint, local only by default
+        :param port: port of the http endpoint, None for no endpoint
+        :param stack_depth: frames of stack reported for a slow step
+        """
+        self.interval = interval
+        self.slow_secs = slow_secs
+        self.report_secs = report_secs
+        self.host = host
+        self.port = port
+        self.stack_depth = stack_depth
+        self.tasks = {}  # task name: TaskStats
+        self.slow = deque(maxlen=20)  # recent slow steps
+        self.running = None  # (task name, perf_counter at start) of the step running now
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._beat = monotonic()
+        self._loop_thread_id = None
+        self._profiling = threading.Lock()
+        self._task_names = set()  # of tasks not yet done
+
+    def install(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Sets the task factory so tasks created from now on are timed and starts the watchdog thread.
+        Call before creating the tasks to be monitored.
+        """
+        def task_factory(task_loop, coro, **kwargs):
+            name = self._task_name(getattr(coro, '__qualname__', type(coro).__name__))
+            task = asyncio.Task(_TimedCoroutine(coro, name, self), loop=task_loop, **kwargs)
+            task.add_done_callback(lambda _: self._task_names.discard(name))
+            return task
+
+        self._loop_thread_id = threading.get_ident()
+        loop.set_task_factory(task_factory)
+        threading.Thread(target=self._watchdog, name='loop_watchdog', daemon=True).start()
+
+    def _task_name(self, base: str) -> str:
+        """
+        Tasks running the same coroutine function are numbered in the order created eg nmea_reader,
+        nmea_reader-2; the number is reused once its task is done so short lived tasks share counters
+        """
+        name = base
+        number = 1
+        while name in self._task_names:
+            number += 1
+            name = f"{base}-{number}"
+        self._task_names.add(name)
+        return name
+
+    def _loop_stack(self) -> list:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return []
+        return [line.rstrip() for line in traceback.format_stack(frame)[-self.stack_depth:]]
+
+    def _watchdog(self) -> None:
+        # runs on its own thread so it can see the loop thread while it is blocked
+        reported = None
+        while True:
+            sleep(self.interval / 2)
+            blocked = monotonic() - self._beat - self.interval  # beat is set just before each sleep of interval
+            if blocked < self.slow_secs:
+                reported = None
+                continue
+            running = self.running
+            if running is not None and (running == reported or perf_counter() - running[1] < self.slow_secs):
+                # already reported, or a short step running after the loop was held by something else
+                continue
+            if running is None and reported == 'callback':
+                continue
+            name = running[0] if running else 'callback'
+            slow = {"task": name, "blocked_ms": round(blocked * 1000), "at": round(monotonic(), 1),
+                    "stack": self._loop_stack()}
+            self.slow.append(slow)
+            reported = running or 'callback'
+            print(f"Event loop blocked {slow['blocked_ms']}ms by {name}")
+            for line in slow["stack"]:
+                print(line)
+
+    def profile(self, seconds: float, interval: float = 0.005, top: int = 20) -> list:
+        """
+        Samples the loop thread's current line for the given seconds; blocking, so run on another thread
+        :return: the most frequently seen lines with their sample counts and percent of samples
+        """
+        with self._profiling:
+            counts = Counter()
+            samples = 0
+            end = monotonic() + seconds
+            while monotonic() < end:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    code = frame.f_code
+                    counts[f"{code.co_filename}:{frame.f_lineno} {code.co_name}"] += 1
+                    samples += 1
+                sleep(interval)
+        samples = max(samples, 1)
+        return [{"where": where, "samples": count, "percent": round(100 * count / samples, 1)}
+                for where, count in counts.most_common(top)]
+
+    def stats(self) -> dict:
+        return {
+            "lag_ms": round(self.lag * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "tasks": {name: stats.as_dict() for name, stats in self.tasks.items()},
+            "slow": list(self.slow)
+        }
+
+    async def _handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    async def _handle_profile(self, request: web.Request) -> web.Response:
+        try:
+            seconds = float(request.query.get('seconds', 10))
+        except ValueError:
+            seconds = None
+        if seconds is None or not seconds > 0:
+            return web.json_response({"error": "seconds must be a positive number"}, status=400)
+        seconds = min(seconds, 300)
+        result = await asyncio.get_running_loop().run_in_executor(None, self.profile, seconds)
+        print(f"Profile of {seconds}s:")
+        for row in result:
+            print(f"    {row['percent']:5.1f}% {row['where']}")
+        return web.json_response(result)
+
+    async def _serve(self) -> None:
+        app = web.Application()
+        app.router.add_get('/monitor', self._handle_stats)
+        app.router.add_get('/profile', self._handle_profile)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        print(f"Monitor at http://{self.host}:{self.port}/monitor")
+
+    def _report(self, last_totals: dict) -> dict:
+        totals = {name: stats.total for name, stats in self.tasks.items()}
+        busiest = sorted(((totals[name] - last_totals.get(name, 0), name) for name in totals), reverse=True)[:5]
+        print(f"Event loop lag {self.lag * 1000:.1f}ms max {self.max_lag * 1000:.1f}ms busiest tasks: " +
+              ", ".join(f"{name} {secs * 1000:.0f}ms" for secs, name in busiest))
+        return totals
+
+    async def run(self, boat_data: dict) -> None:
+        """
+        Measures event loop lag as the overshoot of a sleep, publishes it to boat_data as loop_lag and
+        loop_lag_max (ms), prints a summary every report_secs and serves the http endpoint
+        """
+        if self.port:
+            await self._serve()
+        last_totals = {}
+        next_report = monotonic() + self.report_secs
+        while True:
+            start = monotonic()
+            self._beat = start
+            await asyncio.sleep(self.interval)
+            now = monotonic()
+            lag = max(0.0, now - start - self.interval)
+            self.lag += (lag - self.lag) * 0.1
+            self.max_lag = max(self.max_lag, lag)
+            if now >= next_report:
+                last_totals = self._report(last_totals)
+                boat_data["loop_lag"] = round(self.lag * 1000, 1)
+                boat_data["loop_lag_max"] = round(self.max_lag * 1000, 1)
+                self.max_lag = 0.0
+                next_report = now + self.report_secs
@@ -0,0 +1,187 @@
+from array import array
+from collections import deque
+
+from app.boat_io import AsyncBoatModel
+from app.scheduler import DeadlineClock
+
+
+class RollingStats:
+
+    def __init__(self, size: int, hysteresis: float = 0.5) -> None:
+        """
+        Fixed size ring buffer of the latest samples with streaming statistics.
+        Min and max use monotonic queues and the mean and rms running sums so adding a sample is O(1);
+        percentiles and period are only worked out from the buffer when asked for.
+        :param size: number of samples in the window
+        :param hysteresis: band either side of the mean a signal must cross to count as a crossing,
+                           stops whole degree readings sitting on the mean counting as oscillation
+        """
+        self.size = size
+        self.hysteresis = hysteresis
+        self._buffer = array('d', bytes(8 * size))
+        self._added = 0
+        self._sum = 0.0
+        self._sum2 = 0.0
+        self._max = deque()  # (sample number, value) with decreasing values
+        self._min = deque()  # (sample number, value) with increasing values
+
+    def __len__(self) -> int:
+        return min(self._added, self.size)
+
+    def add(self, value: float) -> None:
+        n = self._added
+        index = n % self.size
+        if n >= self.size:
+            old = self._buffer[index]
+            self._sum -= old
+            self._sum2 -= old * old
+        self._buffer[index] = value
+        self._sum += value
+        self._sum2 += value * value
+        self._added += 1
+        if index == self.size - 1:
+            # remove rounding drift in the running sums once per window
+            self._sum = sum(self._buffer)
+            self._sum2 = sum(v * v for v in self._buffer)
+
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((n, value))
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((n, value))
+        oldest = n - self.size
+        if self._max[0][0] <= oldest:
+            self._max.popleft()
+        if self._min[0][0] <= oldest:
+            self._min.popleft()
+
+    def samples(self) -> list:
+        """
+        Samples in the window oldest first
+        """
+        if self._added < self.size:
+            return self._buffer[:self._added].tolist()
+        index = self._added % self.size
+        return self._buffer[index:].tolist() + self._buffer[:index].tolist()
+
+    @property
+    def max(self) -> float:
+        return self._max[0][1] if self._max else None
+
+    @property
+    def min(self) -> float:
+        return self._min[0][1] if self._min else None
+
+    @property
+    def mean(self) -> float:
+        count = len(self)
+        return self._sum / count if count else None
+
+    @property
+    def rms(self) -> float:
+        """
+        RMS about the mean, so roll and pitch motion is not swamped by a steady heel
+        """
+        count = len(self)
+        if not count:
+            return None
+        mean = self._sum / count
+        return max(0.0, self._sum2 / count - mean * mean) ** 0.5
+
+    def percentiles(self, *percents: float) -> list:
+        ordered = sorted(self.samples())
+        if not ordered:
+            return [None for _ in percents]
+        last = len(ordered) - 1
+        values = []
+        for p in percents:
+            position = last * p / 100
+            lower = int(position)
+            upper = min(lower + 1, last)
+            values.append(ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower))
+        return values
+
+    def period(self, sample_hz: float) -> float:
+        """
+        Dominant period in seconds from the spacing of upward crossings of the mean, None if fewer than
+        two complete cycles are in the window
+        """
+        mean = self.mean
+        if mean is None:
+            return None
+        upper = mean + self.hysteresis
+        lower = mean - self.hysteresis
+        below = None
+        crossings = []
+        for i, value in enumerate(self.samples()):
+            if value < lower:
+                below = True
+            elif value > upper:
+                if below:
+                    crossings.append(i)
+                below = False
+        if len(crossings) < 3:
+            return None
+        return (crossings[-1] - crossings[0]) / (len(crossings) - 1) / sample_hz
+
+
+def motion_summary(name: str, stats: RollingStats, window: int, sample_hz: float) -> dict:
+    """
+    Compact summary of a window as flat boat_data keys eg roll_rms_60
+    """
+    p5, p50, p95 = stats.percentiles(5, 50, 95)
+    period = stats.period(sample_hz)
+    summary = {
+        "min": stats.min,
+        "max": stats.max,
+        "mean": stats.mean,
+        "rms": stats.rms,
+        "p5": p5,
+        "p50": p50,
+        "p95": p95,
+        "period": period
+    }
+    return {f"{name}_{stat}_{window}": round(value, 1) for stat, value in summary.items() if value is not None}
+
+
+async def motion_monitor(boat_data: dict, hw: AsyncBoatModel, sample_hz: float = 20, windows: tuple = (60,),
+                         publish_secs: float = 5):
+    """
+    Samples heal and pitch from the CMPS12 at sample_hz into ring buffers and publishes summaries of each
+    rolling window (seconds) to boat_data every publish_secs. The max and min heal and pitch kept for the
+    log are updated at the full sample rate so short roll peaks are not missed.
+    :param boat_data: Dict of current values
+    :param hw: hardware shared with the autohelm
+    :param sample_hz: IMU sample rate
+    :param windows: window lengths in seconds
+    :param publish_secs: seconds between summaries
+    """
+    roll_stats = [RollingStats(int(window * sample_hz)) for window in windows]
+    pitch_stats = [RollingStats(int(window * sample_hz)) for window in windows]
+    clock = DeadlineClock(sample_hz)
+    publish_every = max(1, round(publish_secs * sample_hz))
+    while True:
+        await clock.tick()
+        attitude = await hw.read_attitude()
+        if attitude is None:
+            continue
+        pitch, heal = attitude
+        for stats in roll_stats:
+            stats.add(heal)
+        for stats in pitch_stats:
+            stats.add(pitch)
+        boat_data["heal"] = heal
+        boat_data["pitch"] = pitch
+        try:
+            boat_data["max_heal"] = max(boat_data["max_heal"], heal)
+            boat_data["min_heal"] = min(boat_data["min_heal"], heal)
+            boat_data["max_pitch"] = max(boat_data["max_pitch"], pitch)
+            boat_data["min_pitch"] = min(boat_data["min_pitch"], pitch)
+        except KeyError:
+            pass
+
+        if clock.ticks % publish_every == 0:
+            for window, roll_window, pitch_window in zip(windows, roll_stats, pitch_stats):
+                boat_data.update(motion_summary("roll", roll_window, window, sample_hz))
+                boat_data.update(motion_summary("pitch", pitch_window, window, sample_hz))
@@ -4,6 +4,12 @@ from typing import Callable
 import aioserial
 import arrow
 
+from app.dedup import LineDedup
+
+
+DECODER_CHANNEL = ("decoder",)  # LineDedup channel for sentences decoded into boat data
+STATUS_VARS = ("status", "wind_status")  # a sentence is void unless its status is A
+
 
 def sign_nmea(symbol, types):
     if types.get(symbol):
@@ -35,12 +41,12 @@ def to_true(amount: float, flag: str, mag_var: float) -> float:
     Returns True bearing or Course
     :param amount: value of direction in degrees
     :param flag: T = True M = Magnetic
-    :param mag_var:  variation to correct magnetic values
+    :param mag_var:  variation to correct magnetic values, E positive
     :return: True value
     """
-    value = amount
+    value = float(amount)
     if flag == 'M':
-        value = amount - mag_var
+        value = round((value + mag_var) % 360, 1)
     return value
 
 
@@ -103,6 +109,11 @@ def_vars = {
     "TOFF": (1, "x.x"),  # Transducer offset -ve from transducer to keel +ve transducer to water line
     "STW": (1, "x.x"),  # Speed Through Water float knots
     "DW": (1, "x.x"),  # Water distance since reset float knots
+    "wind_angle": (1, "x.x"),  # Wind angle 0 to 360 from the bow
+    "wind_ref": (1, "A"),  # Wind reference R = relative (apparent) T = true
+    "wind_speed": (1, "x.x"),  # Wind speed in wind_units
+    "wind_units": (1, "A"),  # Wind speed units K = km/h M = m/s N = knots
+    "wind_status": (1, "A"),  # Wind status A = valid V = invalid
 }
 
 
@@ -115,6 +126,7 @@ sentences = {
     "DPT": ["DBT", "TOFF"],  # 2.8, -0.7
     "VHW": ["", "", "", "", "STW"],  # T,, M, 0.0, N, 0.0, K
     "VLW": ["", "", "WD"],  # 23.2, N, 0.0, N
+    "MWV": ["wind_angle", "wind_ref", "wind_speed", "wind_units", "wind_status"],  # 214.8, R, 0.1, K, A
 }
 
 
@@ -150,7 +162,7 @@ def get_sentence_data(sentence: str, var_names: list, mag_var: float) -> dict:
     """
     Gets a dict of extracted from the NMEA 0183 sentence as defined by var_names
     note depth must be calculated by adding DBT and TOFF together then the measure will be from
-    keel or from waterline
+    keel or from waterline; DerivedData does this as DBK or DBS
     HDM is always magnetic as defined by sentence HDM
     :param sentence - received NMEA 0183 sentence or line read
     :param var_names - list of variables to extract in processing order
@@ -173,56 +185,72 @@ def get_sentence_data(sentence: str, var_names: list, mag_var: float) -> dict:
                 field_values.append(fields.pop(0))
                 x -= 1
             value = get_nmea_field_value(field_values, def_vars[var_name], mag_var)
-            if value:
+            if value is not None:
+                # 0 is a reading eg wind from dead ahead or a calm
                 sentence_data[var_name] = value
         else:
             fields.pop(0)
     return sentence_data
 
 
-def nmea_decoder(sentence: str, data: dict, mag_var: float) -> None:
+def nmea_decoder(sentence: str, data: dict, mag_var: float, ignore: tuple = ()) -> list:
     """
     Decodes a received NMEA 0183 sentence into variables and adds them to current data store
     :param sentence: received  NMEA sentence
     :param data: variables extracted
     :param mag_var: Magnetic Variation for conversion true to magnetic
-
+    :param ignore: talker and sentence ids not decoded eg ("IIHDM", "IIHDG") echoes of our own heading
+    :return: names of the variables set or deleted in data
     """
     code = ""
+    changed = []
     try:
-        if len(sentence) > 9:
+        if len(sentence) > 9 and sentence[1:6] not in ignore:
             code = sentence[3:6]
             if code in sentences:
                 sentence_data = get_sentence_data(sentence, sentences[code], mag_var)
-                if sentence_data.get('status', 'A') == 'A':
+                if all(sentence_data.get(status, 'A') == 'A' for status in STATUS_VARS):
                     for n, v in sentence_data.items():
                         data[n] = v
+                        changed.append(n)
                 else:
                     for n, v in sentence_data.items():
-                        if n in ['time', 'date', 'status']:
+                        if n in ('time', 'date') + STATUS_VARS:
                             data[n] = v
-                        elif data.get(n):
+                            changed.append(n)
+                        elif n in data:
                             del data[n]
+                            changed.append(n)
 
     except (AttributeError, ValueError, ) as err:
         data['error'] = f"NMEA {code} sentence translation error: {err} when processing {sentence}"
+        changed.append('error')
         print(data['error'])
+    return changed
 
 
-async def nmea_reader(aioserial_instance: aioserial.AioSerial, boat_data: dict, call_back: Callable = None) -> None:
+async def nmea_reader(aioserial_instance: aioserial.AioSerial, boat_data: dict, call_back: Callable = None,
+                      on_change: Callable = None, dedup: LineDedup = None, ignore: tuple = ()) -> None:
 
     """
 
     :param aioserial_instance: async serial interface to read NMEA data
     :param boat_data:  Dict of values extracted
     :param call_back:  Optional call back function passing back sentence read
+    :param on_change:  Optional function called with boat_data and the names changed by each sentence
+                       eg DerivedData.update
+    :param dedup:  Optional LineDedup, a sentence already decoded within its window is not decoded again
+    :param ignore:  talker and sentence ids relayed but not decoded eg nmea_emitter.own_heading_ids()
     :return:
     """
     mag_var = 0
     while True:
         line = await aioserial_instance.readline_async()
-        line_str = line.decode(errors='ignore')
-        nmea_decoder(line_str, boat_data, mag_var)
-        mag_var = boat_data.get("mag_var", mag_var)
+        if dedup is None or dedup.filter(line, DECODER_CHANNEL):
+            line_str = line.decode(errors='ignore')
+            changed = nmea_decoder(line_str, boat_data, mag_var, ignore)
+            if changed and on_change:
+                on_change(boat_data, changed)
+            mag_var = boat_data.get("mag_var", mag_var)
         if call_back:
             await call_back(line)
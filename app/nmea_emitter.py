@@ -0,0 +1,122 @@
+import asyncio
+import re
+from functools import reduce
+from operator import xor
+from typing import Callable
+
+from app.scheduler import DeadlineClock
+
+_HEX = [b"%02X" % i for i in range(256)]
+HEADING_IDS = ("HDM", "HDG")
+OWN_TALKER = "AH"  # not an assigned NMEA talker id so no real device on the network sends it
+_FIELD_SPEC = re.compile(rb'%[-+ 0#]*\d*(?:\.\d+)?[a-zA-Z]')
+
+
+def nmea_checksum(data: bytes, start: int = 0) -> int:
+    """
+    XOR of all bytes, the NMEA 0183 checksum of the characters between $ and *
+    :param data: bytes to include
+    :param start: checksum of any bytes already included
+    """
+    return reduce(xor, data, start)
+
+
+class SentenceTemplate:
+
+    def __init__(self, talker: str, body: str) -> None:
+        """
+        A sentence with %-format fields eg SentenceTemplate("HC", "HDM,%.1f,M"). The constant text is
+        split out and its checksum worked out once so rendering only formats and checksums the fields.
+        :param talker: talker id eg HC
+        :param body: sentence id and fields after the talker id without $ or checksum
+        """
+        body_bytes = body.encode()
+        self._specs = _FIELD_SPEC.findall(body_bytes)
+        pieces = _FIELD_SPEC.split(body_bytes)
+        self._prefix = b"$" + talker.encode() + pieces[0]
+        self._after = pieces[1:]
+        self._constant_checksum = nmea_checksum(b"".join(pieces), nmea_checksum(talker.encode()))
+
+    def render(self, *values) -> bytes:
+        """
+        :param values: one for each field
+        :return: complete sentence with checksum and line end
+        """
+        fields = [spec % value for spec, value in zip(self._specs, values)]
+        checksum = nmea_checksum(b"".join(fields), self._constant_checksum)
+        parts = [self._prefix]
+        for field, after in zip(fields, self._after):
+            parts.append(field)
+            parts.append(after)
+        parts.append(b"*")
+        parts.append(_HEX[checksum])
+        parts.append(b"\r\n")
+        return b"".join(parts)
+
+
+def own_heading_ids(talker: str = OWN_TALKER) -> tuple:
+    """
+    Talker and sentence ids of the emitted heading eg ("AHHDM", "AHHDG"); a reader of a port the emitted
+    sentences are written to must not decode these when echoed back or the internal compass would be taken
+    as the external one
+    """
+    return tuple(talker + sentence_id for sentence_id in HEADING_IDS)
+
+
+async def nmea_emitter(boat_data: dict, call_back: Callable, rates: dict = None, talker: str = OWN_TALKER,
+                       rudder_scale: float = None) -> None:
+    """
+    Sends sentences made from the internal sensors to a relay so the plotter and NMEA 2000 network see them:
+    HDM and HDG from the CMPS12 heading, XDR heel (ROLL) and pitch (PTCH) and RSA rudder.
+    Heading is not sent when the external compass is selected as it would echo the external HDM.
+    A sentence is skipped if its data is not available.
+    :param boat_data: Dict of current values
+    :param call_back: called with each sentence eg SentenceRelay.put
+    :param rates: sentence id: Hz, defaults to HDM 10, HDG 1, XDR 2, RSA 2
+    :param talker: talker id, one no other device uses as own_heading_ids(talker) are not decoded from the
+                   ports written with the emitted sentences
+    :param rudder_scale: degrees of rudder per unit of the autohelm rudder estimate (duty x seconds), RSA is
+                         not sent until this has been calibrated
+    """
+    rates = rates or {"HDM": 10, "HDG": 1, "XDR": 2, "RSA": 2}
+    hdm = SentenceTemplate(talker, "HDM,%.1f,M")
+    hdg = SentenceTemplate(talker, "HDG,%.1f,,,%.1f,%s")
+    hdg_no_var = SentenceTemplate(talker, "HDG,%.1f,,,,")
+    xdr = SentenceTemplate(talker, "XDR,A,%.1f,D,ROLL,A,%.1f,D,PTCH")
+    rsa = SentenceTemplate(talker, "RSA,%.1f,A,,V")
+
+    def render_hdg(data: dict) -> bytes:
+        mag_var = data.get("mag_var")
+        if mag_var is None:
+            return hdg_no_var.render(data["compass"])
+        return hdg.render(data["compass"], abs(mag_var), b"E" if mag_var >= 0 else b"W")
+
+    renderers = {
+        "HDM": lambda data: hdm.render(data["compass"]),
+        "HDG": render_hdg,
+        "XDR": lambda data: xdr.render(data["heal"], data["pitch"]),
+        "RSA": lambda data: rsa.render(data["rudder"] * rudder_scale),
+    }
+    rates = {sentence_id: hz for sentence_id, hz in rates.items()
+             if hz and (sentence_id != "RSA" or rudder_scale is not None)}
+    if not rates:
+        # idle rather than end, the other tasks are gathered with this one
+        print("NMEA emitter has no sentences to send")
+        while True:
+            await asyncio.sleep(3600)
+    max_hz = max(rates.values())
+    clock = DeadlineClock(max_hz)
+    schedule = [(sentence_id, max(1, round(max_hz / hz)), renderers[sentence_id])
+                for sentence_id, hz in rates.items()]
+    while True:
+        await clock.tick()
+        for sentence_id, every, render in schedule:
+            if not clock.every(every):
+                continue
+            if sentence_id in HEADING_IDS and boat_data.get("compass_mode") == "ext":
+                continue
+            try:
+                line = render(boat_data)
+            except KeyError:
+                continue
+            await call_back(line)
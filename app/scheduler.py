@@ -0,0 +1,67 @@
+import asyncio
+from time import monotonic
+
+
+class DeadlineClock:
+
+    def __init__(self, rate_hz: float, jitter_smoothing: float = 0.05) -> None:
+        """
+        Runs a loop on absolute monotonic deadlines rather than sleeping a fixed time after the work
+        is done, so the loop rate does not drift with the time taken by Redis, I2C etc.
+        If a deadline is missed an overrun is counted; when a whole period or more has been lost the
+        missed ticks are skipped rather than run back to back so the loop keeps its phase.
+        :param rate_hz: loop rate
+        :param jitter_smoothing: weight of each new sample in the mean jitter
+        """
+        self.period = 1.0 / rate_hz
+        self.jitter_smoothing = jitter_smoothing
+        self.next_at = None
+        self.last_at = None
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.mean_jitter = 0.0
+        self.max_jitter = 0.0
+
+    async def tick(self) -> float:
+        """
+        Waits for the next deadline
+        :return: measured time in seconds since the previous tick, the nominal period on the first tick
+        """
+        now = monotonic()
+        if self.next_at is None:
+            self.next_at = now
+        else:
+            self.next_at += self.period
+            if now > self.next_at:
+                self.overruns += 1
+                missed = int((now - self.next_at) / self.period)
+                if missed:
+                    self.skipped += missed
+                    self.next_at += missed * self.period
+            await asyncio.sleep(max(0.0, self.next_at - now))
+
+        woke_at = monotonic()
+        if self.last_at is None:
+            dt = self.period
+        else:
+            dt = woke_at - self.last_at
+            jitter = woke_at - self.next_at
+            self.mean_jitter += (jitter - self.mean_jitter) * self.jitter_smoothing
+            self.max_jitter = max(self.max_jitter, jitter)
+        self.last_at = woke_at
+        self.ticks += 1
+        return dt
+
+    def every(self, n: int) -> bool:
+        """
+        True on every n th tick, used to run slower work at a divided rate of the loop
+        """
+        return n <= 1 or self.ticks % n == 1
+
+    def stats(self) -> dict:
+        return {
+            "loop_jitter": round(self.mean_jitter * 1000, 2),  # ms
+            "loop_jitter_max": round(self.max_jitter * 1000, 2),  # ms
+            "loop_overruns": self.overruns,
+        }
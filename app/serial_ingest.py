@@ -0,0 +1,251 @@
+"""
+Optional multi-process serial ingestion.
+
+Each worker process reads, frames and decodes a group of serial ports and hands the raw lines and decoded
+updates to the main process through a LineRing per port. Routing, the autohelm and everything else stay on
+the main event loop, so reading and decoding busy ports such as AIS use the other cores of the Pi.
+"""
+import asyncio
+import ctypes
+import json
+import multiprocessing
+import os
+import struct
+import threading
+from multiprocessing.sharedctypes import RawArray, RawValue
+from typing import Callable
+
+import serial
+
+from app.dedup import LineDedup
+from app.nmea_0183 import DECODER_CHANNEL, nmea_decoder
+
+RAW_LINE = 0
+UPDATE = 1
+
+_RECORD = struct.Struct('<HB')  # payload length, kind
+
+
+class LineRing:
+
+    def __init__(self, size: int = 1 << 16) -> None:
+        """
+        Single producer, single consumer ring of length prefixed records in shared memory.
+        The producer only writes head and the consumer only writes tail; both are byte counts which wrap
+        at 2**32. They are published and read holding a shared lock, only for the store or load, as the
+        lock's acquire and release are memory barriers: the ARM cores of the Pi may make plain stores visible
+        to the other process out of order, so without them the consumer could see a new head before the
+        record it covers. Records which do not fit are dropped and counted rather than blocking the reader
+        of a serial port.
+        After each record the producer writes a byte to a non blocking pipe, the consumer waits on
+        wakeup_fd rather than polling.
+        Must be created before the worker process is forked.
+        :param size: buffer size in bytes, a power of 2
+        """
+        if size & (size - 1) or size > 1 << 31:
+            raise ValueError(f"LineRing size {size} must be a power of 2")
+        self.size = size
+        self._buffer = RawArray(ctypes.c_ubyte, size)
+        self._head = RawValue(ctypes.c_uint32, 0)
+        self._tail = RawValue(ctypes.c_uint32, 0)
+        self._dropped = RawValue(ctypes.c_uint32, 0)
+        self._lock = multiprocessing.get_context('fork').Lock()
+        self.wakeup_fd, self._wakeup_write = os.pipe()
+        os.set_blocking(self.wakeup_fd, False)
+        os.set_blocking(self._wakeup_write, False)
+        self._view = None
+
+    @property
+    def view(self) -> memoryview:
+        if self._view is None:
+            self._view = memoryview(self._buffer).cast('B')
+        return self._view
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped.value
+
+    def _copy_in(self, position: int, data: bytes) -> None:
+        start = position % self.size
+        first = min(len(data), self.size - start)
+        self.view[start:start + first] = data[:first]
+        if first < len(data):
+            self.view[:len(data) - first] = data[first:]
+
+    def _copy_out(self, position: int, length: int) -> bytes:
+        start = position % self.size
+        first = min(length, self.size - start)
+        data = self.view[start:start + first].tobytes()
+        if first < length:
+            data += self.view[:length - first].tobytes()
+        return data
+
+    def write(self, kind: int, payload: bytes) -> bool:
+        """
+        Producer side; appends a record
+        :return: False if the record was dropped as the ring is full
+        """
+        head = self._head.value
+        with self._lock:
+            tail = self._tail.value
+        length = _RECORD.size + len(payload)
+        if len(payload) > 0xFFFF or length > self.size - ((head - tail) & 0xFFFFFFFF):
+            self._dropped.value += 1
+            return False
+        self._copy_in(head, _RECORD.pack(len(payload), kind) + payload)
+        with self._lock:
+            self._head.value = (head + length) & 0xFFFFFFFF
+        try:
+            os.write(self._wakeup_write, b"\0")
+        except BlockingIOError:
+            pass  # the pipe is full so the consumer has a wakeup pending
+        return True
+
+    def clear_wakeup(self) -> None:
+        """
+        Consumer side; empties the wakeup pipe, call before read so a record written after is not missed
+        """
+        try:
+            while os.read(self.wakeup_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def read(self) -> list:
+        """
+        Consumer side; removes all complete records
+        :return: list of (kind, payload bytes)
+        """
+        with self._lock:
+            head = self._head.value
+        tail = self._tail.value
+        records = []
+        while tail != head:
+            length, kind = _RECORD.unpack(self._copy_out(tail, _RECORD.size))
+            records.append((kind, self._copy_out(tail + _RECORD.size, length)))
+            tail = (tail + _RECORD.size + length) & 0xFFFFFFFF
+        with self._lock:
+            self._tail.value = tail
+        return records
+
+
+def shared_mag_var() -> RawValue:
+    """
+    Magnetic variation set by the main process from boat_data and used by the workers to correct
+    magnetic bearings. Must be created before the worker process is forked.
+    """
+    return RawValue(ctypes.c_double, 0)
+
+
+def decode_update(line: bytes, data: dict, mag_var: float, ignore: tuple = ()) -> bytes:
+    """
+    Decodes a line into a local copy of the data
+    :param ignore: talker and sentence ids not decoded as nmea_decoder
+    :return: update record payload of the changes, None if nothing changed
+    """
+    changed = nmea_decoder(line.decode(errors='ignore'), data, mag_var, ignore)
+    if not changed:
+        return None
+    update = {"set": {n: data[n] for n in changed if n in data}, "del": [n for n in changed if n not in data]}
+    return json.dumps(update).encode()
+
+
+def _ingest_port(device: str, baud: int, ring: LineRing, decode: bool, ignore: tuple, mag_var: RawValue) -> None:
+    """
+    Reads lines from a serial port decoding them into a local copy of the data, writes the changes as an
+    update record followed by the raw line
+    """
+    serial_port = serial.Serial(port=device, baudrate=baud)
+    data = {}
+    while True:
+        line = serial_port.readline()
+        if decode:
+            update = decode_update(line, data, mag_var.value, ignore)
+            if update:
+                ring.write(UPDATE, update)
+        ring.write(RAW_LINE, line)
+
+
+def ingest_worker(ports: list, mag_var: RawValue) -> None:
+    """
+    Worker process entry; reads each port of the group on its own thread
+    :param ports: list of (device, baud, ring, decode, ignore) ignore as nmea_decoder
+    :param mag_var: from shared_mag_var()
+    """
+    threads = [threading.Thread(target=_ingest_port, args=tuple(port) + (mag_var,), daemon=True) for port in ports]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def start_ingest_worker(ports: list, mag_var: RawValue) -> multiprocessing.Process:
+    """
+    Forks a worker process for a group of ports. Must be called while the main thread is the only thread,
+    before the event loop's executor, the pigpio I/O thread or the monitor's watchdog start, as a lock held
+    by another thread when forking stays locked in the worker.
+    :param ports: list of (device, baud, ring, decode, ignore) the rings must be created before calling
+    :param mag_var: from shared_mag_var(), kept up to date by process_ingest_rings
+    """
+    if threading.active_count() > 1:
+        raise RuntimeError(f"Ingest worker must be started before other threads: {threading.enumerate()}")
+    process = multiprocessing.get_context('fork').Process(target=ingest_worker, args=(ports, mag_var), daemon=True)
+    process.start()
+    return process
+
+
+def _apply_update(payload: bytes, boat_data: dict, on_change: Callable) -> None:
+    update = json.loads(payload)
+    boat_data.update(update["set"])
+    for name in update["del"]:
+        boat_data.pop(name, None)
+    if on_change:
+        on_change(boat_data, list(update["set"]) + update["del"])
+
+
+async def process_ingest_rings(rings: list, boat_data: dict, on_change: Callable = None,
+                               mag_var: RawValue = None, dedup: LineDedup = None) -> None:
+    """
+    Main process side of a worker; applies decoded updates to boat_data and passes raw lines to the relays.
+    Waits on the rings' wakeup pipes so nothing runs on the event loop while the ports are quiet.
+    :param rings: list of (LineRing, call back) the call back is given each raw line eg SentenceRelay.put
+    :param boat_data: Dict of values extracted
+    :param on_change: Optional function called with boat_data and the names changed by each update
+    :param mag_var: Optional shared_mag_var() of the worker, set from boat_data which any port may update
+    :param dedup: Optional LineDedup shared with the nmea_readers, the update of a line already decoded within
+                  its window is not applied
+    """
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+
+    def woken(woken_ring: LineRing) -> None:
+        # emptied here, before the records are read, so the pipe is not seen as readable again meanwhile
+        woken_ring.clear_wakeup()
+        wakeup.set()
+
+    for ring, _ in rings:
+        loop.add_reader(ring.wakeup_fd, woken, ring)
+    pending = [None] * len(rings)  # update held until its raw line is checked for a duplicate
+    try:
+        while True:
+            if mag_var is not None:
+                mag_var.value = boat_data.get("mag_var", mag_var.value)
+            await wakeup.wait()
+            wakeup.clear()
+            for index, (ring, call_back) in enumerate(rings):
+                for kind, payload in ring.read():
+                    if kind == UPDATE:
+                        if dedup is None:
+                            _apply_update(payload, boat_data, on_change)
+                        else:
+                            pending[index] = payload
+                        continue
+                    if pending[index] is not None:
+                        if dedup.filter(payload, DECODER_CHANNEL):
+                            _apply_update(pending[index], boat_data, on_change)
+                        pending[index] = None
+                    if call_back:
+                        await call_back(payload)
+    finally:
+        for ring, _ in rings:
+            loop.remove_reader(ring.wakeup_fd)
@@ -0,0 +1,336 @@
+"""
+Simulated boat hardware for running the autohelm off the boat.
+
+Vessel is a first order (Nomoto) yaw model driven by a rudder moved by the helm motor, with a sea state
+disturbance of wave yaw, gusts and weather helm. SimulatedPi stands in for the pigpio connection so an
+unmodified BoatModel drives the simulated motor and reads a simulated CMPS12.
+
+run_simulation steps the control law on a simulated clock, so runs much faster than real time, and sweep
+evaluates every combination of gain, tsf and base_duty at once using numpy arrays, eg
+
+    result = sweep(gains=range(100, 1000, 25), tsfs=range(500, 3000, 100), base_duties=[0, 50000, 100000])
+    for row in best(result, 5):
+        print(row)
+
+Requires numpy which is only a development dependency.
+"""
+from math import pi as PI
+from time import monotonic
+
+import numpy as np
+
+from app.auto_helm import TURN_RATE_PERIOD, helm_correction, relative_direction
+from app.boat_io import BoatModel, CMPS12_BLOCK, CMPS12_BLOCK_START
+from app.estimator import HeadingEstimator, wrap_direction
+
+GYRO_LSB_PER_DPS = 16  # CMPS12 gyro output in 1/16 degree per second
+
+
+class Vessel:
+
+    def __init__(self, heading: float = 0.0, shape: tuple = (), k: float = 0.3, t: float = 3.0,
+                 rudder_rate: float = 5.0, rudder_limit: float = 30.0, motor_tau: float = 0.1,
+                 sea_state: float = 1.0, wave_period: float = 7.0, gust_tau: float = 4.0,
+                 weather_helm: float = 1.0, heel: float = 10.0, roll_period: float = 5.0, seed: int = 0) -> None:
+        """
+        Yaw and rudder model. State is held in numpy arrays of the given shape so one Vessel can
+        simulate many boats with different controllers; all share the same sea.
+        :param heading: initial heading degrees
+        :param shape: shape of the state arrays, () for a single boat
+        :param k: yaw rate in degrees per second per degree of rudder at steady state
+        :param t: yaw time constant seconds
+        :param rudder_rate: rudder movement in degrees per second at full motor duty
+        :param rudder_limit: rudder stops +/- degrees
+        :param motor_tau: motor response time constant seconds
+        :param sea_state: scales wave yaw, gusts and roll, 0 is flat calm
+        :param wave_period: seconds
+        :param gust_tau: correlation time of gusts seconds
+        :param weather_helm: constant disturbance in degrees of rudder
+        :param heel: mean heel degrees
+        :param roll_period: seconds
+        :param seed: random seed for the gusts, runs with the same seed see the same sea
+        """
+        self.k = k
+        self.t = t
+        self.rudder_rate = rudder_rate
+        self.rudder_limit = rudder_limit
+        self.motor_tau = motor_tau
+        self.sea_state = sea_state
+        self.wave_period = wave_period
+        self.gust_tau = gust_tau
+        self.weather_helm = weather_helm
+        self.heel = heel
+        self.roll_period = roll_period
+        self._random = np.random.RandomState(seed)
+
+        self.time = 0.0
+        self.gust = 0.0
+        self.heading = np.full(shape, float(heading))
+        self.yaw_rate = np.zeros(shape)
+        self.rudder = np.zeros(shape)
+        self.motor = np.zeros(shape)
+
+    def disturbance(self, dt: float) -> float:
+        """
+        Advances the sea by dt and returns the yaw disturbance in equivalent degrees of rudder
+        """
+        decay = np.exp(-dt / self.gust_tau)
+        self.gust = self.gust * decay + 3.0 * self.sea_state * np.sqrt(1 - decay * decay) * self._random.randn()
+        wave = 4.0 * self.sea_state * np.sin(2 * PI * self.time / self.wave_period)
+        return self.weather_helm + wave + self.gust
+
+    def step(self, dt: float, drive) -> None:
+        """
+        Advances the vessel by dt seconds
+        :param dt: time step, keep below about 0.05s
+        :param drive: signed motor duty -1 to 1, positive moves the rudder to turn to starboard
+        """
+        self.time += dt
+        disturbance = self.disturbance(dt)
+        self.motor += (drive - self.motor) * min(1.0, dt / self.motor_tau)
+        self.rudder = np.clip(self.rudder + self.motor * self.rudder_rate * dt, -self.rudder_limit, self.rudder_limit)
+        self.yaw_rate += (self.k * (self.rudder + disturbance) - self.yaw_rate) * dt / self.t
+        self.heading = (self.heading + self.yaw_rate * dt) % 360
+
+    @property
+    def roll(self) -> float:
+        return self.heel + 5.0 * self.sea_state * np.sin(2 * PI * self.time / self.roll_period)
+
+    @property
+    def pitch(self) -> float:
+        return 3.0 * self.sea_state * np.sin(2 * PI * self.time / self.wave_period)
+
+
+class SimClock:
+
+    def __init__(self, start: float = 0.0) -> None:
+        """
+        A clock which only moves when advanced, used in place of monotonic to run faster than real time
+        """
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class SimulatedPi:
+
+    def __init__(self, vessel: Vessel, clock=monotonic, max_step: float = 0.02,
+                 port_pin: int = 24, starboard_pin: int = 23) -> None:
+        """
+        Implements the pigpio calls made by BoatModel against a simulated vessel. The vessel is advanced
+        to the clock time whenever the pi is accessed using the motor drive set at that time.
+        :param vessel: single boat vessel model
+        :param clock: time source, monotonic for real time or a SimClock
+        :param max_step: largest integration step seconds
+        :param port_pin: gpio pin BoatModel drives for port
+        :param starboard_pin: gpio pin BoatModel drives for starboard
+        """
+        self.vessel = vessel
+        self._clock = clock
+        self._last = clock()
+        self.max_step = max_step
+        self.port_pin = port_pin
+        self.starboard_pin = starboard_pin
+        self.levels = {}
+        self.duty = 0
+
+    def drive(self) -> float:
+        direction = 0
+        if self.levels.get(self.starboard_pin):
+            direction = 1
+        elif self.levels.get(self.port_pin):
+            direction = -1
+        return direction * self.duty / 1000000
+
+    def advance(self) -> None:
+        now = self._clock()
+        drive = self.drive()
+        while now - self._last > 1e-9:
+            dt = min(self.max_step, now - self._last)
+            self.vessel.step(dt, drive)
+            self._last += dt
+
+    def _block(self) -> bytes:
+        self.advance()
+        v = self.vessel
+        heading = float(v.heading)
+        roll = float(v.roll)
+        pitch = float(v.pitch)
+        gyo_z = int(-float(v.yaw_rate) * GYRO_LSB_PER_DPS)  # z axis up, positive anti clockwise
+        return CMPS12_BLOCK.pack(
+            int(round(heading * 10)) % 3600, int(pitch), int(roll),
+            0, 0, 0,
+            0, 0, 1000,
+            0, 0, gyo_z,
+            20,
+            int(heading * 16) % 5760, int(pitch * 16),
+            0xFF
+        )
+
+    def set_mode(self, gpio, mode):
+        return 0
+
+    def write(self, gpio, level):
+        self.advance()
+        self.levels[gpio] = level
+        return 0
+
+    def hardware_PWM(self, gpio, frequency, duty):
+        self.advance()
+        self.duty = duty
+        return 0
+
+    def i2c_open(self, bus, address):
+        return 0
+
+    def i2c_read_i2c_block_data(self, handle, reg, count):
+        block = self._block()[reg - CMPS12_BLOCK_START:reg - CMPS12_BLOCK_START + count]
+        return len(block), bytearray(block)
+
+    def i2c_read_byte_data(self, handle, reg):
+        return self._block()[reg - CMPS12_BLOCK_START]
+
+    def i2c_write_byte_data(self, handle, reg, byte_val):
+        return 0
+
+    def stop(self):
+        pass
+
+
+def simulated_boat_model(**vessel_kwargs) -> BoatModel:
+    """
+    A BoatModel running in real time against a simulated vessel, a drop in for BoatModel when
+    settings.simulate_hardware is set
+    """
+    return BoatModel(pi=SimulatedPi(Vessel(**vessel_kwargs)))
+
+
+def run_simulation(gain: int = 325, tsf: int = 1454, base_duty: int = 100000, hts: float = 0.0,
+                   heading: float = 20.0, duration: float = 300.0, settle: float = 30.0,
+                   sample_hz: float = 10, motor_hz: float = 5, estimator: dict = None, **vessel_kwargs) -> dict:
+    """
+    Runs the auto_helm control law against a BoatModel and simulated vessel on a simulated clock.
+    Kept step for step with auto_helm in auto mode, test_matches_auto_helm runs both on the same sea.
+    :param gain: as set by the helm gain key + 1
+    :param tsf: as set by the helm tsf key + 1
+    :param base_duty: helm base_duty
+    :param hts: heading to steer degrees
+    :param heading: initial heading degrees
+    :param duration: simulated seconds
+    :param settle: seconds at the start not scored
+    :param sample_hz: compass sample rate
+    :param motor_hz: motor update rate
+    :param estimator: HeadingEstimator kwargs
+    :param vessel_kwargs: passed to Vessel
+    :return: rms heading error degrees, mean motor duty 0-1 and the heading trace
+    """
+    clock = SimClock()
+    b = BoatModel(pi=SimulatedPi(Vessel(heading=heading, **vessel_kwargs), clock), clock=clock)
+    b.power_on = 1
+    b.base_line_duty = base_duty
+    period = 1.0 / sample_hz
+    motor_every = max(1, round(sample_hz / motor_hz))
+    hts10 = int(hts * 10)
+    heading_estimator = HeadingEstimator(**(estimator or {}))
+    trace = []
+    sum_error2 = 0.0
+    sum_duty = 0.0
+    scored = 0
+    for tick in range(int(duration * sample_hz)):
+        clock.now = tick * period
+        sample = b.read_cmps_block()
+        current, turn_rate = heading_estimator.update(b.compass, sample.gyo_z, period)
+        current = int(round(current)) % 3600
+        correction = int(helm_correction(relative_direction(hts10 - current), turn_rate * TURN_RATE_PERIOD,
+                                         gain, tsf))
+        if tick % motor_every == 0:
+            b.helm(correction)
+        trace.append(current / 10)
+        if clock.now >= settle:
+            sum_error2 += (relative_direction(hts10 - current) / 10) ** 2
+            sum_duty += abs(b.applied_helm_power) / 1000000
+            scored += 1
+    scored = max(scored, 1)
+    return {
+        "rms_error": float(np.sqrt(sum_error2 / scored)),
+        "mean_duty": sum_duty / scored,
+        "heading": trace
+    }
+
+
+def _applied_power(helm_power, base_line_duty):
+    # array version of the duty calculation in BoatModel.helm_drive, test_sweep_matches_boat_model keeps them in step
+    direction = np.where(helm_power < 0, -1, 1)
+    duty = np.trunc(np.abs(helm_power))
+    duty = np.where(duty < 5000, 0, duty + base_line_duty)
+    duty = np.where(duty > 998000, 1000000, duty)
+    return duty * direction
+
+
+def sweep(gains, tsfs, base_duties, hts: float = 0.0, heading: float = 20.0, duration: float = 300.0,
+          settle: float = 30.0, sample_hz: float = 10, motor_hz: float = 5, max_step: float = 0.02,
+          duty_weight: float = 10.0, estimator: dict = None, **vessel_kwargs) -> dict:
+    """
+    Evaluates every combination of gains, tsfs and base_duties in one vectorised simulation. All
+    combinations sail the same sea so the scores are directly comparable.
+    :param gains: iterable of gain values
+    :param tsfs: iterable of turn speed factors
+    :param base_duties: iterable of base line duties
+    :param duty_weight: weight of mean duty (0-1) against rms heading error (degrees) in the score
+    :param estimator: HeadingEstimator kwargs
+    :return: dict of flat arrays; gain, tsf, base_duty, rms_error, mean_duty and score, lower score is better
+    """
+    gain, tsf, base_duty = (a.ravel() for a in np.meshgrid(
+        np.asarray(gains, dtype=float), np.asarray(tsfs, dtype=float), np.asarray(base_duties, dtype=float),
+        indexing='ij'))
+    vessel = Vessel(heading=heading, shape=gain.shape, **vessel_kwargs)
+    period = 1.0 / sample_hz
+    sub_steps = max(1, int(np.ceil(period / max_step)))
+    motor_every = max(1, round(sample_hz / motor_hz))
+    hts10 = int(hts * 10)
+    heading_estimator = HeadingEstimator(**(estimator or {}))
+    power = np.zeros(gain.shape)
+    sum_error2 = np.zeros(gain.shape)
+    sum_duty = np.zeros(gain.shape)
+    scored = 0
+    for tick in range(int(duration * sample_hz)):
+        compass = np.round(vessel.heading * 10) % 3600
+        gyo_z = np.trunc(-vessel.yaw_rate * GYRO_LSB_PER_DPS)
+        current, turn_rate = heading_estimator.update(compass, gyo_z, period)
+        current = np.round(current) % 3600
+        error = wrap_direction(hts10 - current)
+        if tick % motor_every == 0:
+            power = _applied_power(np.trunc(helm_correction(error, turn_rate * TURN_RATE_PERIOD, gain, tsf)),
+                                   base_duty)
+        if tick * period >= settle:
+            sum_error2 += (error / 10) ** 2
+            sum_duty += np.abs(power) / 1000000
+            scored += 1
+        for _ in range(sub_steps):
+            vessel.step(period / sub_steps, power / 1000000)
+    scored = max(scored, 1)
+    rms_error = np.sqrt(sum_error2 / scored)
+    mean_duty = sum_duty / scored
+    return {
+        "gain": gain,
+        "tsf": tsf,
+        "base_duty": base_duty,
+        "rms_error": rms_error,
+        "mean_duty": mean_duty,
+        "score": rms_error + duty_weight * mean_duty
+    }
+
+
+def best(result: dict, n: int = 10) -> list:
+    """
+    The n best scoring rows of a sweep result as dicts
+    """
+    return [{name: float(values[i]) for name, values in result.items()}
+            for i in np.argsort(result["score"])[:n]]
+
+
+if __name__ == "__main__":
+    for row in best(sweep(gains=range(100, 1000, 25), tsfs=range(500, 3000, 100),
+                          base_duties=[0, 50000, 100000]), 10):
+        print(row)
@@ -41,10 +41,32 @@ class TestSentence(unittest.TestCase):
         data = {}
         nmea_decoder("$GPAPB,A,A,5,L,N,V,V,359.,T,1,359.1,T,6,T,A*79", data, 5)
         self.assertDictEqual(data, {'status': 'A', 'XTE': -5.0, 'XTE_units': 'N', 'ACir': 'V', 'APer': 'V',
-                                    'BOD': '359.', 'Did': '1', 'BPD': '359.1', 'HTS': '6'})
+                                    'BOD': 359.0, 'Did': '1', 'BPD': 359.1, 'HTS': 6.0})
+
+    def test_abp_magnetic(self):
+        data = {}
+        nmea_decoder("$GPAPB,A,A,5,L,N,V,V,011,M,1,359.1,M,6,M,A*79", data, -2.0)
+        self.assertEqual((data['BOD'], data['BPD'], data['HTS']), (9.0, 357.1, 4.0))
 
     def test_depth(self):
         data = {}
         nmea_decoder("$SSDPT,2.8,-0.7", data, 5)
         self.assertDictEqual(data, {'DBT': 2.8, 'TOFF': -0.7})
 
+    def test_mwv(self):
+        data = {}
+        nmea_decoder("$WIMWV,214.8,R,10.5,N,A*28", data, 0)
+        self.assertDictEqual(data, {'wind_angle': 214.8, 'wind_ref': 'R', 'wind_speed': 10.5, 'wind_units': 'N',
+                                    'wind_status': 'A'})
+
+    def test_mwv_void(self):
+        data = {'wind_angle': 214.8, 'wind_ref': 'R', 'wind_speed': 10.5, 'wind_units': 'N', 'wind_status': 'A'}
+        changed = nmea_decoder("$WIMWV,10.0,R,3.0,N,V*00", data, 0)
+        self.assertDictEqual(data, {'wind_status': 'V'})
+        self.assertEqual(set(changed), {'wind_angle', 'wind_ref', 'wind_speed', 'wind_units', 'wind_status'})
+
+    def test_mwv_zero(self):
+        data = {}
+        nmea_decoder("$WIMWV,214.8,R,10.5,N,A*28", data, 0)
+        nmea_decoder("$WIMWV,0.0,R,0.0,N,A*28", data, 0)
+        self.assertEqual((data['wind_angle'], data['wind_speed']), (0.0, 0.0))
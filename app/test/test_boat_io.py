@@ -0,0 +1,102 @@
+import asyncio
+import struct
+import threading
+import time
+import unittest
+from app.boat_io import decode_cmps_block, AsyncBoatModel, CMPS12_BLOCK
+
+
+class TestCmpsBlock(unittest.TestCase):
+
+    def test_decode(self):
+        block = bytes([
+            0x0D, 0xFC,  # compass 3580
+            0xFB, 0x07,  # pitch -5 roll 7
+            0x00, 0x10, 0xFF, 0xF0, 0x01, 0x00,  # mag 16 -16 256
+            0x00, 0x01, 0x00, 0x02, 0x03, 0xE8,  # acc 1 2 1000
+            0xFF, 0xFF, 0x00, 0x00, 0x00, 0x64,  # gyro -1 0 100
+            0x00, 0x19,  # temp 25
+            0x16, 0x30,  # bosch heading 5680/16
+            0xFF, 0xB0,  # pitch 16 -80
+            0xFF  # calibration
+        ])
+        self.assertEqual(len(block), CMPS12_BLOCK.size)
+        sample = decode_cmps_block(block)
+        self.assertEqual(sample.compass, 3580)
+        self.assertEqual((sample.pitch, sample.roll), (-5, 7))
+        self.assertEqual((sample.mag_x, sample.mag_y, sample.mag_z), (16, -16, 256))
+        self.assertEqual((sample.acc_x, sample.acc_y, sample.acc_z), (1, 2, 1000))
+        self.assertEqual((sample.gyo_x, sample.gyo_y, sample.gyo_z), (-1, 0, 100))
+        self.assertEqual(sample.temp, 25)
+        self.assertEqual(sample.bosch_heading / 16, 355)
+        self.assertEqual(sample.pitch_16, -80)
+        self.assertEqual(sample.calibration, 255)
+
+    def test_short_block(self):
+        with self.assertRaises(struct.error):
+            decode_cmps_block(bytes(10))
+
+
+class FakeModel:
+
+    def __init__(self):
+        self.calls = []
+        self.threads = set()
+
+    def _record(self, name, *args):
+        self.threads.add(threading.current_thread().name)
+        self.calls.append((name,) + args)
+
+    def helm(self, correction):
+        time.sleep(0.001 * (correction % 3))  # varying durations must not reorder calls
+        self._record("helm", correction)
+
+    def read_attitude(self):
+        self._record("read_attitude")
+        return -3, 5
+
+    def config_save(self):
+        time.sleep(0.3)  # CMPS12 store sequence sleeps between commands
+        self._record("config_save")
+
+
+class TestAsyncBoatModel(unittest.TestCase):
+
+    def setUp(self):
+        self.hw = AsyncBoatModel(FakeModel)
+
+    def tearDown(self):
+        self.hw.close()
+
+    def test_order_and_thread(self):
+        async def run():
+            model = await self.hw.open()
+            await asyncio.gather(*[self.hw.helm(i) for i in range(20)], self.hw.read_attitude())
+            return model, await self.hw.read_attitude()
+        model, attitude = asyncio.run(run())
+        self.assertEqual(attitude, (-3, 5))
+        self.assertEqual(model.calls[:20], [("helm", i) for i in range(20)])
+        self.assertEqual(len(model.threads), 1)
+        self.assertTrue(model.threads.pop().startswith("boat_io"))
+
+    def test_config_save_does_not_block_loop(self):
+        async def ticker(stop):
+            ticks = 0
+            while not stop.is_set():
+                await asyncio.sleep(0.01)
+                ticks += 1
+            return ticks
+
+        async def run():
+            await self.hw.open()
+            stop = asyncio.Event()
+            ticking = asyncio.ensure_future(ticker(stop))
+            start = time.monotonic()
+            await self.hw.config_save()
+            elapsed = time.monotonic() - start
+            stop.set()
+            return elapsed, await ticking
+        elapsed, ticks = asyncio.run(run())
+        self.assertGreaterEqual(elapsed, 0.3)
+        # the loop kept running while the I/O thread slept
+        self.assertGreater(ticks, 10)
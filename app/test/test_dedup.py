@@ -0,0 +1,55 @@
+import unittest
+from app.dedup import LineDedup
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLineDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.stats = {}
+        self.dedup = LineDedup({"default": 1.0, "HDM": 0}, self.clock, self.stats)
+
+    def test_echo(self):
+        rmc = b"$GPRMC,110910.59,A,5047.3986,N,00054.6007,W,0.08,0.19,150920,0.24,W,D,V*75\r\n"
+        self.assertEqual(self.dedup.filter(rmc, ["q_to_2000", "q_udp"]), ["q_to_2000", "q_udp"])
+        self.clock.now += 0.3
+        # echoed back by the gateway without the \r
+        self.assertEqual(self.dedup.filter(rmc.rstrip() + b"\n", ["q_from_2000", "q_udp"]), ["q_from_2000"])
+        self.assertEqual(self.dedup.suppressed["q_udp"], 1)
+        self.assertEqual(self.stats["dup_suppressed"], 1)
+
+    def test_window_expires(self):
+        line = b"!AIVDM,1,1,,A,13aEOK?P00PD2wVMdLDRhgvL289?,0*26\r\n"
+        self.assertEqual(self.dedup.filter(line, ["q_udp"]), ["q_udp"])
+        self.clock.now += 0.9
+        self.assertEqual(self.dedup.filter(line, ["q_udp"]), [])
+        self.clock.now += 0.2
+        self.assertEqual(self.dedup.filter(line, ["q_udp"]), ["q_udp"])
+        self.assertEqual(len(self.dedup._seen), 1)
+
+    def test_not_checked(self):
+        line = b"$HCHDM,172.5,M*28\r\n"
+        self.assertEqual(self.dedup.filter(line, ["q_udp"]), ["q_udp"])
+        self.assertEqual(self.dedup.filter(line, ["q_udp"]), ["q_udp"])
+
+    def test_gateway_echo(self):
+        self.dedup.watch("q_to_2000")
+        hdm = b"$AHHDM,123.4,M*00\r\n"
+        # HDM is not checked for duplicates but is still remembered as sent to the gateway
+        self.assertEqual(self.dedup.filter(hdm, ["q_to_2000", "q_udp"]), ["q_to_2000", "q_udp"])
+        self.clock.now += 0.3
+        self.assertTrue(self.dedup.is_echo(hdm.rstrip() + b"\n", "q_to_2000"))
+        self.assertFalse(self.dedup.is_echo(b"$IIHDM,123.4,M*00\r\n", "q_to_2000"))
+        self.assertEqual(self.dedup.suppressed["echo"], 1)
+        self.clock.now += 1.0
+        self.assertFalse(self.dedup.is_echo(hdm, "q_to_2000"))
+        self.assertFalse(self.dedup.is_echo(hdm, "q_udp"))  # not watched
@@ -0,0 +1,74 @@
+import unittest
+from app.derived import Derived, DerivedData
+from app.nmea_0183 import nmea_decoder
+
+
+class TestDerived(unittest.TestCase):
+
+    def decode(self, sentence, data, derived):
+        return derived.update(data, nmea_decoder(sentence, data, data.get('mag_var', 0)))
+
+    def test_depth(self):
+        data = {}
+        derived = DerivedData()
+        self.assertEqual(self.decode("$SSDPT,2.8,-0.7", data, derived), ['DBK'])
+        self.assertEqual(data['DBK'], 2.1)
+        self.assertEqual(self.decode("$SSDPT,2.8,0.5", data, derived), ['DBK', 'DBS'])
+        self.assertNotIn('DBK', data)
+        self.assertEqual(data['DBS'], 3.3)
+
+    def test_only_changed(self):
+        calls = []
+        derived = DerivedData([Derived("x2", ("x",), lambda x: calls.append(x) or x * 2)])
+        data = {"x": 1, "y": 1}
+        derived.update(data, ["y"])
+        self.assertEqual(calls, [])
+        derived.update(data, ["x"])
+        self.assertEqual(data["x2"], 2)
+        derived.update(data, ["x"])
+        self.assertEqual(calls, [1, 1])
+
+    def test_dependency_order(self):
+        derived = DerivedData([
+            Derived("c", ("b",), lambda b: b + 1),
+            Derived("b", ("a",), lambda a: a + 1),
+        ])
+        data = {"a": 1}
+        self.assertEqual(derived.update(data, ["a"]), ["b", "c"])
+        self.assertEqual(data["c"], 3)
+        with self.assertRaises(ValueError):
+            DerivedData([Derived("a", ("b",), abs), Derived("b", ("a",), abs)])
+
+    def test_true_wind(self):
+        data = {'STW': 5.0, 'mag_var': 0.0}
+        derived = DerivedData()
+        self.decode("$HCHDM,100.0,M*00", data, derived)
+        self.decode("$WIMWV,90.0,R,5.0,N,A*00", data, derived)
+        self.assertEqual(data['AWS'], 5.0)
+        self.assertEqual(data['TWS'], 7.1)
+        self.assertEqual(data['TWA'], 135.0)
+        self.assertEqual(data['TWD'], 235.0)
+
+    def test_variation(self):
+        data = {'STW': 5.0}
+        derived = DerivedData()
+        self.decode("$HCHDM,100.0,M*00", data, derived)
+        self.decode("$WIMWV,90.0,R,5.0,N,A*00", data, derived)
+        # magnetic heading is not given as true
+        self.assertNotIn('HDT', data)
+        self.assertNotIn('TWD', data)
+        self.assertEqual(data['TWA'], 135.0)
+        self.decode("$GPRMC,110910.59,A,5000.0000,N,00100.0000,W,5.0,90.0,150920,2.0,W,D,V*75", data, derived)
+        self.assertEqual(data['HDT'], 98.0)
+        self.assertEqual(data['TWD'], 233.0)
+        self.decode("$HCHDG,,,,3.5,E*00", data, derived)
+        self.assertEqual(data['HDT'], 103.5)
+        self.assertEqual(data['TWD'], 238.5)
+
+    def test_trip(self):
+        data = {}
+        derived = DerivedData()
+        self.decode("$GPRMC,110910.59,A,5000.0000,N,00100.0000,W,5.0,90.0,150920,0.0,W,D,V*75", data, derived)
+        self.assertEqual(data['trip'], 0)
+        self.decode("$GPRMC,111910.59,A,5001.0000,N,00100.0000,W,5.0,90.0,150920,0.0,W,D,V*75", data, derived)
+        self.assertAlmostEqual(data['trip'], 1.0, delta=0.01)
@@ -0,0 +1,40 @@
+import unittest
+from app.estimator import HeadingEstimator, wrap_direction
+
+
+class TestHeadingEstimator(unittest.TestCase):
+
+    def test_wrap(self):
+        self.assertEqual(wrap_direction(3590 - 10), -20)
+        self.assertEqual(wrap_direction(10 - 3590), 20)
+        self.assertEqual(wrap_direction(100), 100)
+
+    def test_steady_turn_through_north(self):
+        est = HeadingEstimator()
+        heading = 3500.0
+        for _ in range(200):  # 2 degrees per second to starboard at 10Hz, gyro counts anti clockwise
+            heading = (heading + 2) % 3600
+            h, rate = est.update(heading, -2 * 16, 0.1)
+        self.assertAlmostEqual(rate, 20, delta=0.5)
+        self.assertAlmostEqual(wrap_direction(h - heading), 0, delta=5)
+
+    def test_gyro_bias_removed(self):
+        est = HeadingEstimator(bias_time_constant=10)
+        for _ in range(3000):
+            h, rate = est.update(900, 8, 0.1)  # half a degree per second bias
+        self.assertAlmostEqual(rate, 0, delta=0.2)
+        self.assertAlmostEqual(h, 900, delta=1)
+
+    def test_external_heading(self):
+        est = HeadingEstimator(external_weight=1.0)
+        for _ in range(200):
+            h, rate = est.update(900, 0, 0.1, external=950)
+        self.assertAlmostEqual(h, 950, delta=1)
+
+    def test_no_gyro(self):
+        est = HeadingEstimator()
+        heading = 0.0
+        for _ in range(100):
+            heading += 1
+            h, rate = est.update(heading, None, 0.1)
+        self.assertAlmostEqual(rate, 10, delta=0.5)
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import unittest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from app.live_feed import LiveFeed, _Client
+
+
+class WebSocket:
+
+    def __init__(self):
+        self.closed = None
+
+    async def close(self, code=1000, message=b''):
+        self.closed = code
+
+
+def received(client):
+    messages = []
+    while not client.queue.empty():
+        messages.append(json.loads(client.queue.get_nowait()))
+    return messages
+
+
+class TestLiveFeed(unittest.TestCase):
+
+    def setUp(self):
+        self.boat_data = {"compass": 10.0, "SOG": 2.0, "auto_helm": "stand-by"}
+        self.feed = LiveFeed(self.boat_data, tick_hz=10, queue_size=4)
+
+    def test_delta_and_rate(self):
+        async def run():
+            everything = _Client(WebSocket(), 20)
+            compass = _Client(WebSocket(), 20)
+            self.feed._subscribe(everything, [], None)
+            self.feed._subscribe(compass, ["compass"], 5)
+            self.assertEqual(received(everything), [self.boat_data])
+            self.assertEqual(received(compass), [{"compass": 10.0}])
+            self.feed.tick(1)
+            # nothing changed since the snapshot
+            self.assertEqual(received(everything), [])
+            self.boat_data["compass"] = 11.0
+            self.feed.tick(2)
+            self.boat_data["compass"] = 12.0
+            self.boat_data["auto_helm"] = "auto"
+            self.feed.tick(3)
+            self.feed.tick(4)
+            del self.boat_data["SOG"]
+            self.feed.tick(5)
+            self.assertEqual(received(everything), [{"compass": 11.0}, {"compass": 12.0, "auto_helm": "auto"},
+                                                    {"SOG": None}])
+            # at half the tick rate only the latest value is sent
+            self.assertEqual(received(compass), [{"compass": 11.0}, {"compass": 12.0}])
+        asyncio.run(run())
+
+    def test_shared_payload(self):
+        async def run():
+            clients = [_Client(WebSocket(), 4) for _ in range(3)]
+            for client in clients:
+                self.feed._subscribe(client, ["compass"], 10)
+            self.assertEqual(len(self.feed.groups), 1)
+            self.feed.tick(1)
+            self.boat_data["compass"] = 11.0
+            self.feed.tick(2)
+            payloads = [client.queue._queue[-1] for client in clients]
+            self.assertIs(payloads[0], payloads[1])
+            self.assertIs(payloads[0], payloads[2])
+        asyncio.run(run())
+
+    def test_slow_client_dropped(self):
+        async def run():
+            slow = _Client(WebSocket(), 4)
+            self.feed._subscribe(slow, ["compass"], None)
+            for tick in range(1, 6):
+                self.boat_data["compass"] = float(tick)
+                self.feed.tick(tick)
+            await asyncio.sleep(0)
+            self.assertEqual(self.feed.dropped, 1)
+            self.assertEqual(slow.ws.closed, 1008)
+            self.assertEqual(self.feed.groups, {})
+        asyncio.run(run())
+
+    def test_first_tick_after_idle(self):
+        async def run():
+            self.feed.tick(1)
+            self.boat_data["compass"] = 11.0
+            self.feed.tick(2)
+            client = _Client(WebSocket(), 4)
+            self.feed._subscribe(client, [], None)
+            self.feed.tick(3)
+            self.boat_data["SOG"] = 2.5
+            self.feed.tick(4)
+            return received(client)
+        self.assertEqual(asyncio.run(run()), [{"compass": 11.0, "SOG": 2.0, "auto_helm": "stand-by"}, {"SOG": 2.5}])
+
+    def test_writer_closed_socket(self):
+        class Closed(WebSocket):
+            async def send_str(self, payload):
+                raise ConnectionResetError("Cannot write to closing transport")
+
+        async def run():
+            client = _Client(Closed(), 4)
+            self.feed._subscribe(client, [], None)
+            await asyncio.wait_for(self.feed._writer(client), 1)
+            return client
+        client = asyncio.run(run())
+        self.assertIsNone(client.group)
+        self.assertEqual(self.feed.groups, {})
+
+    def test_bad_subscription(self):
+        async def run():
+            client = _Client(WebSocket(), 4)
+            self.feed._subscribe(client, ["compass"], 2)
+            for names, rate in [(["compass"], 0), (["compass"], "0"), (["compass"], "abc"), (["compass"], -1),
+                                (["compass"], "nan"), (["compass"], True), (["compass"], [2]), ("compass", 2),
+                                ([1, 2], 2)]:
+                with self.assertRaises(ValueError):
+                    self.feed._subscribe(client, names, rate)
+            # the previous subscription is kept
+            self.assertEqual(list(self.feed.groups), [(frozenset(["compass"]), 5)])
+        asyncio.run(run())
+
+    def test_bad_query(self):
+        async def run():
+            app = web.Application()
+            app.router.add_get('/live', self.feed._handle)
+            async with TestClient(TestServer(app)) as http:
+                ws = await http.ws_connect('/live?vars=compass&rate=0')
+                error = await ws.receive_json()
+                await ws.send_json({"vars": "compass"})
+                error_vars = await ws.receive_json()
+                await ws.send_json({"vars": ["compass"], "rate": 2})
+                snapshot = await ws.receive_json()
+                await ws.close()
+            return error, error_vars, snapshot
+        error, error_vars, snapshot = asyncio.run(run())
+        self.assertIn("error", error)
+        self.assertEqual(error_vars, error)
+        self.assertEqual(snapshot, {"compass": 10.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import asyncio
+import time
+import unittest
+from aiohttp.test_utils import make_mocked_request
+from app.monitor import LoopMonitor
+
+
+async def blocker(secs):
+    time.sleep(secs)
+    await asyncio.sleep(0)
+    time.sleep(secs / 10)
+
+
+class TestLoopMonitor(unittest.TestCase):
+
+    def test_step_timing(self):
+        monitor = LoopMonitor(slow_secs=0.05, port=None)
+
+        async def run():
+            monitor.install(asyncio.get_running_loop())
+            await asyncio.gather(asyncio.ensure_future(blocker(0.1)), asyncio.ensure_future(blocker(0.01)))
+        asyncio.run(run())
+        first, second = monitor.tasks["blocker"], monitor.tasks["blocker-2"]
+        self.assertEqual((first.steps, second.steps), (2, 2))
+        self.assertGreaterEqual(first.max, 0.1)
+        self.assertGreaterEqual(first.total, 0.11)
+        self.assertEqual((first.slow, second.slow), (1, 0))
+        self.assertLess(second.max, 0.05)
+
+    def test_name_reused_when_done(self):
+        monitor = LoopMonitor(port=None)
+
+        async def run():
+            monitor.install(asyncio.get_running_loop())
+            await asyncio.ensure_future(blocker(0))
+            await asyncio.ensure_future(blocker(0))
+        asyncio.run(run())
+        self.assertNotIn("blocker-2", monitor.tasks)
+        self.assertEqual(monitor.tasks["blocker"].steps, 4)
+
+    def test_watchdog_names_blocking_task(self):
+        monitor = LoopMonitor(interval=0.02, slow_secs=0.1, port=None, report_secs=60)
+
+        async def run():
+            monitor.install(asyncio.get_running_loop())
+            lag = asyncio.ensure_future(monitor.run({}))
+            await asyncio.sleep(0.1)
+            await asyncio.ensure_future(blocker(0.3))
+            await asyncio.sleep(0.1)
+            lag.cancel()
+        asyncio.run(run())
+        self.assertEqual([slow["task"] for slow in monitor.slow], ["blocker"])
+        self.assertGreaterEqual(monitor.slow[0]["blocked_ms"], 100)
+        self.assertTrue(any("time.sleep(secs)" in line for line in monitor.slow[0]["stack"]))
+
+    def test_profile_bad_seconds(self):
+        monitor = LoopMonitor(port=None)
+
+        async def run():
+            statuses = []
+            for seconds in ("abc", "0", "-1", "nan"):
+                request = make_mocked_request("GET", f"/profile?seconds={seconds}")
+                statuses.append((await monitor._handle_profile(request)).status)
+            return statuses
+        self.assertEqual(asyncio.run(run()), [400] * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
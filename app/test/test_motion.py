@@ -0,0 +1,40 @@
+import math
+import unittest
+from app.motion import RollingStats, motion_summary
+
+
+class TestRollingStats(unittest.TestCase):
+
+    def test_window(self):
+        stats = RollingStats(4)
+        for v in [5, 1, 3, 2, 4, 0]:
+            stats.add(v)
+        self.assertEqual(stats.samples(), [3, 2, 4, 0])
+        self.assertEqual((stats.min, stats.max), (0, 4))
+        self.assertAlmostEqual(stats.mean, 2.25)
+        self.assertAlmostEqual(stats.rms, math.sqrt(sum((v - 2.25) ** 2 for v in [3, 2, 4, 0]) / 4))
+        self.assertEqual(stats.percentiles(0, 50, 100), [0, 2.5, 4])
+
+    def test_max_expires(self):
+        stats = RollingStats(3)
+        for v in [9, 1, 1, 1]:
+            stats.add(v)
+        self.assertEqual(stats.max, 1)
+
+    def test_roll_period(self):
+        sample_hz = 20
+        stats = RollingStats(60 * sample_hz)
+        for i in range(60 * sample_hz):
+            stats.add(round(10 + 8 * math.sin(2 * math.pi * i / sample_hz / 6.0)))
+        self.assertAlmostEqual(stats.period(sample_hz), 6.0, delta=0.1)
+        summary = motion_summary("roll", stats, 60, sample_hz)
+        self.assertEqual(summary["roll_max_60"], 18)
+        self.assertEqual(summary["roll_min_60"], 2)
+        self.assertAlmostEqual(summary["roll_period_60"], 6.0, delta=0.1)
+
+    def test_steady(self):
+        stats = RollingStats(100)
+        for _ in range(100):
+            stats.add(7)
+        self.assertIsNone(stats.period(20))
+        self.assertEqual(stats.rms, 0)
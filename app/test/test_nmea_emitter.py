@@ -0,0 +1,87 @@
+import asyncio
+import unittest
+from app.nmea_0183 import nmea_decoder
+from app.nmea_emitter import SentenceTemplate, nmea_checksum, nmea_emitter, own_heading_ids
+
+
+def checksum_of(line: bytes) -> str:
+    cs = 0
+    for c in line[1:line.index(b"*")]:
+        cs ^= c
+    return f"{cs:02X}"
+
+
+class TestTemplate(unittest.TestCase):
+
+    def test_checksum(self):
+        self.assertEqual(nmea_checksum(b"GPZDA,110910.59,15,09,2020,00,00"), 0x6F)
+
+    def test_render(self):
+        hdm = SentenceTemplate("HC", "HDM,%.1f,M")
+        line = hdm.render(172.46)
+        self.assertEqual(line[:-4], b"$HCHDM,172.5,M*")
+        self.assertEqual(line[-4:-2].decode(), checksum_of(line))
+        self.assertTrue(line.endswith(b"\r\n"))
+
+    def test_render_many_fields(self):
+        xdr = SentenceTemplate("II", "XDR,A,%.1f,D,ROLL,A,%.1f,D,PTCH")
+        for heal, pitch in [(0, 0), (-12.3, 4.5), (45, -90)]:
+            line = xdr.render(heal, pitch)
+            self.assertEqual(line[:-4], f"$IIXDR,A,{heal:.1f},D,ROLL,A,{pitch:.1f},D,PTCH*".encode())
+            self.assertEqual(line[-4:-2].decode(), checksum_of(line))
+
+
+class TestEmitter(unittest.TestCase):
+
+    def test_emit(self):
+        sent = []
+
+        async def call_back(line):
+            sent.append(line)
+
+        async def run():
+            boat_data = {"compass": 123.4, "mag_var": -1.5, "heal": 10, "compass_mode": "int"}
+            task = asyncio.ensure_future(nmea_emitter(boat_data, call_back, {"HDM": 20, "HDG": 10, "XDR": 10}))
+            await asyncio.sleep(0.12)
+            boat_data["compass_mode"] = "ext"
+            count = len(sent)
+            await asyncio.sleep(0.1)
+            task.cancel()
+            return count
+
+        count = asyncio.run(run())
+        self.assertEqual(sent[0][:-4], b"$AHHDM,123.4,M*")
+        self.assertEqual(sent[1][:-4], b"$AHHDG,123.4,,,1.5,W*")
+        self.assertEqual(len(sent), count)  # heading not sent with the external compass, no pitch for XDR
+        self.assertFalse([line for line in sent if b"XDR" in line])
+
+    def emit(self, boat_data, rates, **kwargs):
+        sent = []
+
+        async def call_back(line):
+            sent.append(line)
+
+        async def run():
+            task = asyncio.ensure_future(nmea_emitter(boat_data, call_back, rates, **kwargs))
+            await asyncio.sleep(0.05)
+            self.assertFalse(task.done())  # still running, an exception would end the service
+            task.cancel()
+        asyncio.run(run())
+        return sent
+
+    def test_rsa_needs_scale(self):
+        boat_data = {"rudder": 2.0}
+        self.assertEqual(self.emit(boat_data, {"RSA": 20}), [])
+        self.assertEqual(self.emit(boat_data, {"HDM": 0, "RSA": 0}, rudder_scale=1.5), [])
+        sent = self.emit(boat_data, {"RSA": 20}, rudder_scale=1.5)
+        self.assertEqual(sent[0][:-4], b"$AHRSA,3.0,A,,V*")
+
+    def test_echo_not_decoded(self):
+        sent = self.emit({"compass": 123.4, "mag_var": -1.5}, {"HDM": 20, "HDG": 20})
+        data = {}
+        for line in sent:
+            self.assertTrue(line.startswith(b"$AH"))
+            self.assertEqual(nmea_decoder(line.decode(), data, 0, own_heading_ids()), [])
+        self.assertEqual(data, {})
+        nmea_decoder("$IIHDM,120.5,M*00", data, 0, own_heading_ids())
+        self.assertEqual(data, {"HDM": 120.5})
@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+from app.scheduler import DeadlineClock
+
+
+class FakeTime:
+    """
+    monotonic and asyncio.sleep for the scheduler; sleeping advances the time by the delay plus oversleep
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.oversleep = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay + self.oversleep
+
+
+class TestDeadlineClock(unittest.TestCase):
+
+    def setUp(self):
+        self.time = FakeTime()
+        patchers = [patch('app.scheduler.monotonic', self.time.monotonic),
+                    patch('app.scheduler.asyncio.sleep', self.time.sleep)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.clock = DeadlineClock(4)  # 0.25s period, exact in binary
+
+    def run_ticks(self, work_times):
+        """
+        Ticks once then for each work time advances the time by it and ticks again
+        :return: dt returned by each tick
+        """
+        async def run():
+            dts = [await self.clock.tick()]
+            for work in work_times:
+                self.time.now += work
+                dts.append(await self.clock.tick())
+            return dts
+        return asyncio.run(run())
+
+    def test_steady(self):
+        dts = self.run_ticks([0.0625] * 4)
+        self.assertEqual(dts, [0.25] * 5)
+        self.assertEqual(self.time.sleeps, [0.1875] * 4)
+        self.assertEqual((self.clock.overruns, self.clock.skipped), (0, 0))
+        self.assertEqual(self.clock.ticks, 5)
+        self.assertEqual(self.clock.stats(), {"loop_jitter": 0.0, "loop_jitter_max": 0.0, "loop_overruns": 0})
+
+    def test_no_drift_with_oversleep(self):
+        self.time.oversleep = 0.015625
+        self.run_ticks([0.0625] * 3)
+        # each sleep is shortened by the previous oversleep so deadlines stay on the 0.25s grid
+        self.assertEqual(self.time.sleeps, [0.1875, 0.171875, 0.171875])
+        self.assertEqual(self.clock.max_jitter, 0.015625)
+        self.assertGreater(self.clock.mean_jitter, 0)
+
+    def test_overrun_within_period(self):
+        dts = self.run_ticks([0.375, 0.0625])
+        self.assertEqual(self.clock.overruns, 1)
+        self.assertEqual(self.clock.skipped, 0)
+        # runs late without sleeping then catches up to the original phase
+        self.assertEqual(self.time.sleeps, [0.0, 0.0625])
+        self.assertEqual(dts, [0.25, 0.375, 0.125])
+        self.assertEqual(self.clock.max_jitter, 0.125)
+
+    def test_missed_ticks_skipped(self):
+        self.run_ticks([0.875, 0.0625])
+        self.assertEqual(self.clock.overruns, 1)
+        self.assertEqual(self.clock.skipped, 2)
+        # the skipped deadlines are not run back to back, the next one is on the original phase
+        self.assertEqual(self.time.sleeps, [0.0, 0.0625])
+        self.assertEqual(self.time.now, 1001.0)
+
+    def test_every(self):
+        due = []
+
+        async def run():
+            for _ in range(7):
+                await self.clock.tick()
+                due.append((self.clock.every(1), self.clock.every(3)))
+        asyncio.run(run())
+        self.assertTrue(all(every_1 for every_1, _ in due))
+        # the first tick runs everything then every third
+        self.assertEqual([every_3 for _, every_3 in due], [True, False, False, True, False, False, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
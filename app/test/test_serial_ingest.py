@@ -0,0 +1,134 @@
+import asyncio
+import json
+import multiprocessing
+import threading
+import time
+import unittest
+from app.dedup import LineDedup
+from app.serial_ingest import (LineRing, RAW_LINE, UPDATE, decode_update, process_ingest_rings,
+                               shared_mag_var, start_ingest_worker)
+
+
+def _produce_later(ring, count):
+    for i in range(count):
+        time.sleep(0.02)
+        ring.write(RAW_LINE, f"$GPHDM,{i},M\r\n".encode())
+
+
+def _produce(ring, count):
+    for i in range(count):
+        while not ring.write(RAW_LINE, f"$GPHDM,{i},M\r\n".encode()):
+            pass
+
+
+class TestLineRing(unittest.TestCase):
+
+    def test_wrap(self):
+        ring = LineRing(64)
+        for i in range(20):
+            self.assertTrue(ring.write(UPDATE, f"line {i:02}".encode()))
+            self.assertEqual(ring.read(), [(UPDATE, f"line {i:02}".encode())])
+
+    def test_full(self):
+        ring = LineRing(32)
+        self.assertTrue(ring.write(RAW_LINE, bytes(20)))
+        self.assertFalse(ring.write(RAW_LINE, bytes(20)))
+        self.assertEqual(ring.dropped, 1)
+        self.assertEqual(ring.read(), [(RAW_LINE, bytes(20))])
+        self.assertTrue(ring.write(RAW_LINE, bytes(20)))
+
+    def test_size(self):
+        with self.assertRaises(ValueError):
+            LineRing(1000)
+
+    def test_between_processes(self):
+        ring = LineRing(256)
+        process = multiprocessing.get_context('fork').Process(target=_produce, args=(ring, 500))
+        process.start()
+        lines = []
+        while len(lines) < 500:
+            lines.extend(payload for _, payload in ring.read())
+        process.join()
+        self.assertEqual(lines, [f"$GPHDM,{i},M\r\n".encode() for i in range(500)])
+
+
+class TestIngest(unittest.TestCase):
+
+    def test_mag_var_from_main(self):
+        mag_var = shared_mag_var()
+        boat_data = {"mag_var": -2.0}
+        ring = LineRing(256)
+
+        async def run():
+            task = asyncio.ensure_future(process_ingest_rings([(ring, None)], boat_data, mag_var=mag_var))
+            await asyncio.sleep(0.01)
+            task.cancel()
+        asyncio.run(run())
+        self.assertEqual(mag_var.value, -2.0)
+        # as the worker decodes with it
+        update = json.loads(decode_update(b"$GPAPB,A,A,5,L,N,V,V,011,M,1,011,M,011,M*00\r\n", {}, mag_var.value))
+        self.assertEqual(update["set"]["HTS"], 9.0)
+        self.assertIsNone(decode_update(b"$GPXXX,1\r\n", {}, mag_var.value))
+
+    def test_echo_decoded_once(self):
+        dedup = LineDedup({"default": 1.0})
+        boat_data = {}
+        changes = []
+        relayed = []
+        ring = LineRing(1024)
+        line = b"$SDDPT,2.8,-0.7*00\r\n"
+        for _ in range(2):
+            # the line and its echo from the gateway
+            ring.write(UPDATE, decode_update(line, {}, 0))
+            ring.write(RAW_LINE, line)
+
+        async def call_back(raw):
+            relayed.append(raw)
+
+        async def run():
+            task = asyncio.ensure_future(process_ingest_rings([(ring, call_back)], boat_data,
+                                                              lambda data, changed: changes.append(changed),
+                                                              dedup=dedup))
+            await asyncio.sleep(0.01)
+            task.cancel()
+        asyncio.run(run())
+        self.assertEqual(boat_data, {"DBT": 2.8, "TOFF": -0.7})
+        self.assertEqual(changes, [["DBT", "TOFF"]])
+        self.assertEqual(relayed, [line, line])
+        self.assertEqual(dedup.suppressed["decoder"], 1)
+
+    def test_wakeup(self):
+        ring = LineRing(256)
+        relayed = []
+        wakeups = []
+
+        async def call_back(raw):
+            relayed.append(raw)
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            task = asyncio.ensure_future(process_ingest_rings([(ring, call_back)], {}))
+            await asyncio.sleep(0.01)
+            read = ring.read
+            ring.read = lambda: wakeups.append(1) or read()
+            process = multiprocessing.get_context('fork').Process(target=_produce_later, args=(ring, 3))
+            process.start()
+            while len(relayed) < 3:
+                await asyncio.sleep(0.005)
+            await loop.run_in_executor(None, process.join)
+            task.cancel()
+        asyncio.run(asyncio.wait_for(run(), 5))
+        self.assertEqual(relayed, [f"$GPHDM,{i},M\r\n".encode() for i in range(3)])
+        # woken by each line rather than polling while idle
+        self.assertEqual(len(wakeups), 3)
+
+    def test_start_worker_with_threads(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        try:
+            with self.assertRaises(RuntimeError):
+                start_ingest_worker([], shared_mag_var())
+        finally:
+            stop.set()
+            thread.join()
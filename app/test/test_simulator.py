@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+from app.auto_helm import auto_helm
+from app.boat_io import AsyncBoatModel, BoatModel
+from app.simulator import SimClock, SimulatedPi, Vessel, run_simulation, sweep
+
+
+class Finished(Exception):
+    pass
+
+
+class FakeRedis:
+    """
+    Helm commands as the web app would leave them to hold a course in auto
+    """
+
+    def __init__(self, hts, gain, tsf, base_duty):
+        self.helm = {b'auto_mode': b'2', b'compass_mode': b'1', b'hts': str(int(hts * 10)).encode(),
+                     b'gain': str(gain - 1).encode(), b'tsf': str(tsf - 1).encode(),
+                     b'base_duty': str(base_duty).encode()}
+
+    async def hgetall(self, key):
+        return dict(self.helm)
+
+    async def hset(self, key, field, value):
+        if key == "helm":
+            self.helm[field.encode()] = str(value).encode()
+
+
+class TestSimulator(unittest.TestCase):
+
+    def test_sweep_matches_boat_model(self):
+        single = run_simulation(gain=325, tsf=1454, base_duty=100000, duration=60, settle=10)
+        swept = sweep([100, 325], [1454], [0, 100000], duration=60, settle=10)
+        i = 3  # gain 325, tsf 1454, base_duty 100000
+        self.assertEqual(swept["gain"][i], 325)
+        self.assertEqual(swept["base_duty"][i], 100000)
+        self.assertAlmostEqual(swept["rms_error"][i], single["rms_error"])
+        self.assertAlmostEqual(swept["mean_duty"][i], single["mean_duty"])
+
+    def test_matches_auto_helm(self):
+        # the real control loop on the same simulated clock and sea steers the same course
+        duration = 30
+        clock = SimClock()
+        model = BoatModel(pi=SimulatedPi(Vessel(heading=20.0), clock), clock=clock)
+        hw = AsyncBoatModel(lambda: model)
+        boat_data = {}
+        trace = []
+
+        async def sleep(delay):
+            if "compass" not in boat_data:
+                return  # the start up wait, both begin sailing at time 0
+            trace.append(boat_data["compass"])
+            clock.now += delay
+            if clock.now >= duration - 1e-9:
+                raise Finished
+
+        async def create_redis_pool(host):
+            return FakeRedis(hts=0.0, gain=325, tsf=1454, base_duty=100000)
+
+        async def run():
+            await hw.open()
+            with patch('settings.redis_host', 'localhost'), \
+                    patch('app.auto_helm.aioredis.create_redis_pool', create_redis_pool), \
+                    patch('app.auto_helm.asyncio.sleep', sleep), \
+                    patch('app.scheduler.monotonic', clock):
+                with self.assertRaises(Finished):
+                    await auto_helm(boat_data, hw)
+            hw.close()
+        asyncio.run(run())
+        expected = run_simulation(gain=325, tsf=1454, base_duty=100000, hts=0.0, heading=20.0, duration=duration)
+        self.assertEqual(len(trace), len(expected["heading"]))
+        self.assertEqual(trace, expected["heading"])
+
+    def test_holds_course_in_calm(self):
+        result = run_simulation(heading=10, hts=0, sea_state=0, weather_helm=0, duration=120, settle=60)
+        self.assertLess(result["rms_error"], 2.0)  # within the 5000 duty dead band
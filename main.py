@@ -12,7 +12,15 @@ from aiofile import AIOFile
 from time import monotonic
 import settings
 from app.auto_helm import auto_helm
+from app.boat_io import AsyncBoatModel, BoatModel
+from app.dedup import LineDedup
+from app.derived import DerivedData
+from app.live_feed import live_feed
+from app.monitor import LoopMonitor
+from app.motion import motion_monitor
 from app.nmea_0183 import nmea_reader
+from app.nmea_emitter import OWN_TALKER, nmea_emitter, own_heading_ids
+from app.serial_ingest import LineRing, process_ingest_rings, shared_mag_var, start_ingest_worker
 from copy import copy
 # declare context var
 queue_dict = contextvars.ContextVar('distribution queues')
@@ -84,7 +92,7 @@ async def log(boat_data: dict):
 
 class SentenceRelay:
 
-    def __init__(self, name: str,  q_list: list) -> None:
+    def __init__(self, name: str,  q_list: list, dedup: LineDedup = None, echo_of: str = None) -> None:
         """
         SentenceRelay is typically used to send NMEA sentences to different Queues
         A list of named queues is given when creating the task.
@@ -92,10 +100,18 @@ class SentenceRelay:
         using the key name.
         :param name: Name of mux
         :param q_list: A list of names which should match an item in global context queue_dict
+        :param dedup: Optional LineDedup shared by the relays, a sentence already put to a queue
+                      within its window is dropped
+        :param echo_of: Optional queue name, with dedup a sentence put to that queue within the echo window is
+                        dropped eg sentences sent to the NMEA 2000 gateway and read back from it
         """
         self.name = name
         self.q_list = q_list
         self.disabled_list = []
+        self.dedup = dedup
+        self.echo_of = echo_of if dedup else None
+        if self.echo_of:
+            dedup.watch(echo_of)
 
     def disable(self, named_q: str) -> None:
         # print(f"disable {named_q} in {self.name}")
@@ -114,12 +130,16 @@ class SentenceRelay:
         :param line:
 
         """
+        if self.echo_of and self.dedup.is_echo(line, self.echo_of):
+            return
         q_dist = queue_dict.get()
-        for q_name in self.q_list:
-            if q_name not in self.disabled_list:
-                q = q_dist.get(q_name)
-                if q:
-                    await q.put(line)
+        q_names = [q_name for q_name in self.q_list if q_name not in self.disabled_list]
+        if self.dedup:
+            q_names = self.dedup.filter(line, q_names)
+        for q_name in q_names:
+            q = q_dist.get(q_name)
+            if q:
+                await q.put(line)
 
 
 async def relay_serial_input(aioserial_instance: aioserial.AioSerial, relay: SentenceRelay):
@@ -170,8 +190,16 @@ async def process_udp_queue(read_queue: str, ip: str, port: int, relays_writing_
             await asyncio.sleep(20)
 
 
-def open_serial(attached_devs, port_name, device_name, baud, serial_devices):
+def open_serial(attached_devs, port_name, device_name, baud, serial_devices, process_devices, output_devices,
+                write_names):
     if attached_devs.get(port_name):
+        if device_name in process_devices:
+            # read by its ingest worker process, written from here if a queue is written to it
+            print(f"Assigned {device_name} at {port_name} = {attached_devs[port_name]} to ingest process")
+            process_devices[device_name] = (attached_devs[port_name], baud)
+            if device_name in write_names:
+                output_devices[device_name] = aioserial.AioSerial(port=attached_devs[port_name], baudrate=baud)
+            return
         print(f"Opened {device_name} at {port_name} = {attached_devs[port_name]}")
         serial_device = aioserial.AioSerial(port=attached_devs[port_name], baudrate=baud)
         serial_devices[device_name] = serial_device
@@ -203,8 +231,91 @@ def find_usb_devices(device_def: dict) -> dict:
     return attached_devs
 
 
+def own_ids_by_port(tasks, relays) -> dict:
+    """
+    The heading sent by an emitter must not be decoded as the external compass when echoed back by a port it is
+    written to eg the gateway
+    :return: device name: talker and sentence ids not decoded from it
+    """
+    ids = {}
+    for task_def in tasks:
+        if task_def['task'] == "nmea_emitter":
+            queues = relays[task_def['kwargs']["relay_to"]]
+            own_ids = own_heading_ids(task_def['kwargs'].get("talker", OWN_TALKER))
+            for write_def in tasks:
+                if write_def['task'] == "write_queue_to_serial" and write_def['kwargs']["read_queue"] in queues:
+                    device_name = write_def['kwargs']["write_serial"]
+                    ids[device_name] = ids.get(device_name, ()) + own_ids
+    return ids
+
+
+async def open_hardware() -> AsyncBoatModel:
+    if settings.simulate_hardware:
+        from app.simulator import simulated_boat_model
+        hw = AsyncBoatModel(simulated_boat_model)
+    else:
+        hw = AsyncBoatModel(BoatModel)
+    await hw.open()
+    return hw
+
+
+def start_ingest_workers(process_devices: dict, echo_ids: dict) -> dict:
+    """
+    Forks a worker process for each nmea_reader_process task with an attached port
+    :param process_devices: device name: (device, baud) of the ports assigned to workers
+    :param echo_ids: as own_ids_by_port
+    :return: index in settings.tasks: (shared mag_var, list of (LineRing, relay name or None))
+    """
+    workers = {}
+    for index, task_def in enumerate(settings.tasks):
+        if task_def['task'] != "nmea_reader_process":
+            continue
+        kwargs = task_def['kwargs']
+        worker_ports = []
+        rings = []
+        for port_def in kwargs["ports"]:
+            if process_devices.get(port_def["read_serial"]):
+                device, baud = process_devices[port_def["read_serial"]]
+                ring = LineRing(kwargs.get("ring_size", 1 << 16))
+                worker_ports.append((device, baud, ring, port_def.get("decode", True),
+                                     echo_ids.get(port_def["read_serial"], ())))
+                rings.append((ring, port_def.get("relay_to")))
+        if worker_ports:
+            mag_var = shared_mag_var()
+            start_ingest_worker(worker_ports, mag_var)
+            workers[index] = (mag_var, rings)
+    return workers
+
+
 async def main(consumers):
 
+    # attached_devs = get_usb_devices()  # attached usb devices by interface name eg
+    attached_devs = find_usb_devices(settings.usb_serial_devices)  # attached usb devices by interface name eg
+    # multi port fdi device port 0 has an interface name "ftdi_multi_00"
+    serial_devices = {}  # opened async serial devices by device name eg compass
+
+    # ports read by nmea_reader_process tasks are opened in their worker process - device name: (device, baud)
+    process_devices = {}
+    for task_def in settings.tasks:
+        if task_def['task'] == "nmea_reader_process":
+            for port_def in task_def['kwargs']['ports']:
+                process_devices[port_def["read_serial"]] = None
+
+    # write only handles of ports read by a worker process - device name: aioserial
+    output_devices = {}
+    write_names = {task_def['kwargs']['write_serial'] for task_def in settings.tasks
+                   if task_def['task'] == "write_queue_to_serial"}
+
+    # Configure serial ports and assign a logical name to be used for reading and writing
+    for serial_name, sp in settings.serial_ports.items():
+        open_serial(attached_devs, serial_name, sp['name'], sp['baud'], serial_devices, process_devices,
+                    output_devices, write_names)
+
+    echo_ids = own_ids_by_port(settings.tasks, settings.relays)
+
+    # forked while this is the only thread, before redis name lookup starts the loop's executor threads
+    workers = start_ingest_workers(process_devices, echo_ids)
+
     if settings.redis_host:
         redis_conn = await aioredis.create_redis_pool(settings.redis_host)
     else:
@@ -212,31 +323,39 @@ async def main(consumers):
 
     redis_connect.set(redis_conn)
 
-    # attached_devs = get_usb_devices()  # attached usb devices by interface name eg
-    attached_devs = find_usb_devices(settings.usb_serial_devices)  # attached usb devices by interface name eg
-    # multi port fdi device port 0 has an interface name "ftdi_multi_00"
     boat_data = {}  # data obtained from NMEA reader
-    serial_devices = {}  # opened async serial devices by device name eg compass
+    derived = DerivedData()  # depth below keel, true wind etc updated from the decoded data
     q_dist = {}
     for q_name in settings.distribution_queues:
         q_dist[q_name] = asyncio.Queue()
     queue_dict.set(q_dist)
+    dedup = None
+    if settings.dedup_windows:
+        dedup = LineDedup(settings.dedup_windows, stats=boat_data, echo_window=settings.dedup_echo_window)
     relay_objs = {}
     for r_name, relay_q_list in settings.relays.items():
-        relay_objs[r_name] = SentenceRelay(r_name, relay_q_list)
-
-    # Configure serial ports and assign a logical name to be used for reading and writing
-    for serial_name, sp in settings.serial_ports.items():
-        open_serial(attached_devs, serial_name, sp['name'], sp['baud'], serial_devices)
+        relay_objs[r_name] = SentenceRelay(r_name, relay_q_list, dedup, settings.relay_echoes.get(r_name))
 
+    hardware = None  # CMPS12 and helm motor shared by the tasks using them
     tasks_to_run = []
-    for task_def in settings.tasks:
+    for index, task_def in enumerate(settings.tasks):
         tn = task_def['task']
         kwargs = task_def.get('kwargs', {})
-        if tn == "auto_helm":
-            tasks_to_run.append(asyncio.create_task(auto_helm(boat_data)))
+        if tn in ("auto_helm", "motion_monitor") and hardware is None:
+            hardware = await open_hardware()
+        if tn == "monitor":
+            # only tasks created after the monitor are timed so it should be first in settings.tasks
+            monitor = LoopMonitor(**kwargs)
+            monitor.install(asyncio.get_running_loop())
+            tasks_to_run.append(asyncio.create_task(monitor.run(boat_data)))
+        elif tn == "auto_helm":
+            tasks_to_run.append(asyncio.create_task(auto_helm(boat_data, hardware, **kwargs)))
+        elif tn == "motion_monitor":
+            tasks_to_run.append(asyncio.create_task(motion_monitor(boat_data, hardware, **kwargs)))
         elif tn == "log":
             tasks_to_run.append(asyncio.create_task(log(boat_data)))
+        elif tn == "live_feed":
+            tasks_to_run.append(asyncio.create_task(live_feed(boat_data, **kwargs)))
         elif tn == "udp_sender":
             kwargs["relays"] = relay_objs
             tasks_to_run.append(asyncio.create_task(process_udp_queue(**kwargs)))
@@ -244,8 +363,20 @@ async def main(consumers):
             serial_obj = serial_devices.get(kwargs["read_serial"])
             if serial_obj:
                 tasks_to_run.append(asyncio.create_task(
-                    nmea_reader(serial_obj, boat_data, relay_objs[kwargs["relay_to"]].put)
+                    nmea_reader(serial_obj, boat_data, relay_objs[kwargs["relay_to"]].put, derived.update, dedup,
+                                echo_ids.get(kwargs["read_serial"], ()))
                 ))
+        elif tn == "nmea_reader_process" and index in workers:
+            mag_var, rings = workers[index]
+            rings = [(ring, relay_objs[relay_to].put if relay_to else None) for ring, relay_to in rings]
+            tasks_to_run.append(asyncio.create_task(
+                process_ingest_rings(rings, boat_data, derived.update, mag_var=mag_var, dedup=dedup)
+            ))
+        elif tn == "nmea_emitter":
+            emitter_kwargs = {k: v for k, v in kwargs.items() if k != "relay_to"}
+            tasks_to_run.append(asyncio.create_task(
+                nmea_emitter(boat_data, relay_objs[kwargs["relay_to"]].put, **emitter_kwargs)
+            ))
         elif tn == "relay_serial_input":
             serial_obj = serial_devices.get(kwargs["read_serial"])
             if serial_obj:
@@ -253,12 +384,14 @@ async def main(consumers):
                     relay_serial_input(serial_obj, relay_objs[kwargs["relay_to"]])
                 ))
         elif tn == "write_queue_to_serial":
-            serial_obj = serial_devices.get(kwargs["write_serial"])
+            serial_obj = serial_devices.get(kwargs["write_serial"]) or output_devices.get(kwargs["write_serial"])
             if serial_obj:
                 consumers.append(
                     asyncio.create_task(
                         write_queue_to_serial(kwargs["read_queue"], serial_obj))
                 )
+            else:
+                print(f"Not writing {kwargs['read_queue']}: {kwargs['write_serial']} is not attached")
 
     await asyncio.gather(*tasks_to_run)
 
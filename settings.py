@@ -1,6 +1,8 @@
 
 redis_host = 'redis://localhost'   # set to done if redis is not used/required
 
+simulate_hardware = False   # run tasks using the CMPS12 and helm motor against the simulated vessel (needs numpy)
+
 # Identify usb ports by their device unique properties rather than for example  {'DEVNAME': '/dev/ttyUSB3'} which might
 # change as ports are connected and re-connected or with each system deployment
 usb_serial_devices = {
@@ -36,9 +38,33 @@ relays = {
     "to_2000": ["q_to_2000", "q_udp"]
 }
 
+# drop a sentence already sent to the same queue, or decoded, within the window in seconds for its sentence id eg
+# one reaching q_udp from both relays. 0 to not check a sentence id, set to None to not check at all or echoes.
+# A window should be shorter than the interval a sentence may repeat unchanged: 0.05s is under the 0.1s of the HDM
+# emitted at 10Hz, 0.4s is under the 1s of HDG and of DPT, VHW, MWV etc which repeat at 1-2Hz
+dedup_windows = {"default": 0.4, "HDM": 0.05, "HDG": 0.4, "XDR": 0.2, "RSA": 0.2}
+
+# relay: queue; a sentence arriving at the relay which was put to the queue within dedup_echo_window seconds is
+# dropped, the gateway echoes what it is sent to the NMEA 2000 network back to us
+relay_echoes = {"from_2000": "q_to_2000"}
+dedup_echo_window = 1.0
+
 tasks = (
-    {'task': "auto_helm"},
+    # event loop lag, per task timing and slow step reports with an endpoint at http://127.0.0.1:8090/monitor
+    # a sampling profile of the loop can be taken with http://127.0.0.1:8090/profile?seconds=10
+    {'task': "monitor", "kwargs": {"slow_secs": 0.1, "report_secs": 60, "port": 8090}},
+    {'task': "auto_helm", "kwargs": {"sample_hz": 10, "motor_hz": 5, "helm_hz": 2,
+                                     "estimator": {"time_constant": 2.0, "external_weight": 1.0}}},
+    {'task': "motion_monitor", "kwargs": {"sample_hz": 20, "windows": (60, 600), "publish_secs": 5}},
     {'task': "log"},
+    # changed boat data pushed to dashboards at ws://<pi>:8091/live?vars=compass,auto_helm&rate=2
+    {'task': "live_feed", "kwargs": {"host": "0.0.0.0", "port": 8091, "tick_hz": 10, "queue_size": 8}},
+    # internal compass, heel and pitch and rudder as HDM, HDG, XDR and RSA sentences at the given rates in Hz.
+    # HDM and HDG with this talker id are not decoded from ports written with these sentences, eg the gateway
+    # echoes them back, so use a talker id no device on the network uses.
+    # rudder_scale is degrees per unit of the rudder estimate (duty x seconds), RSA is only sent once it is set
+    {"task": "nmea_emitter", "kwargs": {"relay_to": 'to_2000', "rates": {"HDM": 10, "HDG": 1, "XDR": 2, "RSA": 2},
+                                        "talker": "AH", "rudder_scale": None}},
     {"task": "udp_sender", "kwargs": {"read_queue": "q_udp", "ip": "192.168.0.100", "port": 8011,
                                       "relays_writing_udp": ["from_2000", "to_2000"]}},
     {"task": "relay_serial_input", "kwargs": {"read_serial": 'ais', "relay_to": 'to_2000'}},
@@ -46,6 +72,12 @@ tasks = (
     {"task": "nmea_reader", "kwargs": {"read_serial": 'compass', "relay_to": 'to_2000'}},
     # {"task": "nmea_reader", "kwargs": {"read_serial": 'combined_log_depth', "relay_to": 'to_2000'}},
     {"task": "nmea_reader", "kwargs": {"read_serial": 'blue_next_gps_dongle', "relay_to": 'to_2000'}},
+    # To read and decode ports in a worker process on another core replace their nmea_reader and
+    # relay_serial_input tasks with a group eg. A port read by a worker can still be written by its
+    # write_queue_to_serial task, eg q_to_2000 to the nmea_2000_bridge below
+    # {"task": "nmea_reader_process", "kwargs": {"ports": [
+    #     {"read_serial": 'ais', "relay_to": 'to_2000', "decode": False},
+    #     {"read_serial": 'nmea_2000_bridge', "relay_to": 'from_2000'}]}},
     {"task": "write_queue_to_serial", "kwargs": {"read_queue": "q_to_2000", "write_serial": "nmea_2000_bridge"}},
     {"task": "write_queue_to_serial", "kwargs": {"read_queue": "q_from_2000", "write_serial": "position"}},
 